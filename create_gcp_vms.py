@@ -1,15 +1,172 @@
 import argparse
+import asyncio
+import difflib
+import getpass
+import hashlib
+import json
+import os
+import random
 import re
+import sqlite3
 import sys
 import threading
+import time
+import uuid
 import warnings
-from typing import Any, List
+from contextlib import asynccontextmanager, closing, contextmanager, nullcontext, redirect_stdout
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional, Tuple
 
+import aiohttp
+import google.auth
+import paramiko
+import requests
+from google.api_core import exceptions
 from google.api_core.extended_operation import ExtendedOperation
+from google.auth.transport.requests import AuthorizedSession, Request
 from google.cloud import compute_v1
+from google.protobuf import json_format
+from requests.adapters import HTTPAdapter
+
+
+CLOUD_PLATFORM_SCOPE = "https://www.googleapis.com/auth/cloud-platform"
+COMPUTE_API = "https://compute.googleapis.com/compute/v1"
+
+# Requests per minute per project, kept a little under the default GCE read and write quotas.
+DEFAULT_RATE_LIMITS = {"read": 1200, "write": 1200}
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "create_gcp_vms")
+IMAGE_CACHE_TTL = 3600
+CATALOG_TTL = 24 * 3600
+DEFAULT_MACHINE_TYPE = "t2d-standard-1"
+DEFAULT_DISK_TYPE = "pd-standard"
+DEFAULT_DISK_SIZE_GB = 10
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "RATE_LIMIT_EXCEEDED"}
+STOCKOUT_CODES = {"ZONE_RESOURCE_POOL_EXHAUSTED", "ZONE_RESOURCE_POOL_EXHAUSTED_WITH_DETAILS"}
+QUOTA_CODES = {"QUOTA_EXCEEDED", "quotaExceeded"}
+RETRY_ATTEMPTS = 8
+# What the guest agent logs on the serial console once the startup scripts are done (or there are none).
+STARTUP_DONE = re.compile(r"Finished running startup scripts|No startup scripts to run")
+# Guest attribute namespace the startup script wrapper publishes its phase to, and the phases that end a wait.
+READY_NAMESPACE = "create-gcp-vms"
+READY_PHASES = {"service-up", "failed"}
+# Lifecycle actions as (doing, done) for progress messages, and the statuses each one applies to.
+LIFECYCLE_ACTIONS = {"delete": ("Deleting", "deleted"), "stop": ("Stopping", "stopped"),
+                     "start": ("Starting", "started"), "suspend": ("Suspending", "suspended"),
+                     "resume": ("Resuming", "resumed")}
+ACTION_STATUSES = {"stop": {"PROVISIONING", "STAGING", "RUNNING"}, "start": {"TERMINATED"},
+                   "suspend": {"RUNNING"}, "resume": {"SUSPENDED"}}
+# Statuses on the way to TERMINATED or SUSPENDED, which a restart has to wait out.
+SETTLING_STATUSES = {"STOPPING", "SUSPENDING"}
+
+_client_lock = threading.RLock()
+_clients: Dict[Tuple[Any, Optional[str]], Any] = {}
+_credentials = None
+_session: Optional[AuthorizedSession] = None
+_pool_size = 10
+
+
+class TokenBucket:
+    # Paces calls to rate_per_minute, allowing bursts of up to ten seconds' worth of tokens.
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, self.rate * 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        # Take a token now and return how long the caller has to wait for it; a negative balance is the queue.
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self) -> None:
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self) -> None:
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+_rate_limits = dict(DEFAULT_RATE_LIMITS)
+_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+
+def configure_rate_limits(read_per_minute: float = None, write_per_minute: float = None) -> None:
+    with _client_lock:
+        if read_per_minute:
+            _rate_limits["read"] = read_per_minute
+        if write_per_minute:
+            _rate_limits["write"] = write_per_minute
+        _buckets.clear()
+
+
+def rate_limiter(project_id: str, call_class: str) -> TokenBucket:
+    # GCE meters reads (get, list, operation polls) and writes (insert, delete, ...) separately per project.
+    with _client_lock:
+        bucket = _buckets.get((project_id, call_class))
+        if bucket is None:
+            bucket = _buckets[(project_id, call_class)] = TokenBucket(_rate_limits[call_class])
+        return bucket
+
+
+def _mount_pool(session: AuthorizedSession, pool_size: int) -> None:
+    # Keep-alive pool sized to the worker count; the urllib3 default of 10 makes busier workers queue up.
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+
+
+def configure_client_pool(pool_size: int) -> None:
+    global _pool_size
+    with _client_lock:
+        if pool_size <= _pool_size:
+            return
+        _pool_size = pool_size
+        if _session is not None:
+            _mount_pool(_session, pool_size)
 
-import argparse
-import threading
+
+def shared_credentials():
+    global _credentials
+    with _client_lock:
+        if _credentials is None:
+            _credentials, _ = google.auth.default(scopes=[CLOUD_PLATFORM_SCOPE])
+        return _credentials
+
+
+def get_client(client_cls, project_id: str = None):
+    # One client per class (and per project shard) for the whole process, sharing one credential and HTTP session.
+    global _session
+    with _client_lock:
+        client = _clients.get((client_cls, project_id))
+        if client is None:
+            if _session is None:
+                _session = AuthorizedSession(shared_credentials())
+                _mount_pool(_session, _pool_size)
+            client = client_cls(credentials=shared_credentials())
+            # Each REST transport opens its own AuthorizedSession; point it at the shared one instead.
+            client._transport._session = _session
+            _clients[(client_cls, project_id)] = client
+        return client
+
+
+def client_pool_stats() -> Dict[str, int]:
+    requests = connections = 0
+    if _session is not None:
+        pools = _session.get_adapter("https://").poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            requests += pool.num_requests
+            connections += pool.num_connections
+    return {"requests": requests, "connections_opened": connections,
+            "connections_reused": max(requests - connections, 0)}
 
 
 def wait_for_extended_operation(
@@ -34,12 +191,225 @@ def wait_for_extended_operation(
     return result
 
 
-def create_instance(
-        project_id: str,
+def wait_for_zone_operation(project_id: str, zone: str, operation: ExtendedOperation,
+                            verbose_name: str = "operation", timeout: int = 300) -> Any:
+    # operation.result() polls on its own, outside the rate limiter; zoneOperations.wait long-polls server side
+    # for up to two minutes per call and each call takes a read token.
+    operations_client = get_client(compute_v1.ZoneOperationsClient, project_id)
+    deadline = time.monotonic() + timeout
+
+    def wait():
+        rate_limiter(project_id, "read").acquire()
+        return operations_client.wait(project=project_id, zone=zone, operation=operation.name)
+
+    while with_retries(wait).status != compute_v1.Operation.Status.DONE:
+        if time.monotonic() > deadline:
+            raise FutureTimeoutError(f"{verbose_name} did not finish in {timeout} seconds")
+    # The operation is done, so result() makes one last get to pick up its errors and warnings.
+    rate_limiter(project_id, "read").acquire()
+    return wait_for_extended_operation(operation, verbose_name)
+
+
+def error_codes(error: Exception) -> set:
+    # REST errors come as dicts, client library operation errors as proto messages.
+    codes = set()
+    for item in getattr(error, "errors", None) or []:
+        if isinstance(item, dict):
+            codes.update({item.get("reason"), item.get("code")})
+        else:
+            codes.update({getattr(item, "reason", None), getattr(item, "code", None)})
+    codes.discard(None)
+    return codes
+
+
+def is_rate_limited(error: Exception) -> bool:
+    if isinstance(error, exceptions.TooManyRequests):
+        return True
+    if isinstance(error, exceptions.Forbidden):
+        return bool(error_codes(error) & RATE_LIMIT_REASONS) or "rate limit" in error.message.lower()
+    return False
+
+
+def is_stockout(error: Exception) -> bool:
+    return bool(error_codes(error) & STOCKOUT_CODES) or any(code in str(error) for code in STOCKOUT_CODES)
+
+
+def is_timeout(error: Exception) -> bool:
+    return isinstance(error, (TimeoutError, asyncio.TimeoutError, FutureTimeoutError, exceptions.DeadlineExceeded))
+
+
+def classify_error(error: Exception) -> str:
+    # retryable: back off and try again; stockout: try the next zone; quota and fatal: give up on this VM.
+    if is_stockout(error):
+        return "stockout"
+    if is_rate_limited(error) or is_timeout(error):
+        return "retryable"
+    if error_codes(error) & QUOTA_CODES or re.search(r"quota .*exceeded", str(error), re.IGNORECASE):
+        return "quota"
+    # The sync clients run on requests, whose connection errors and timeouts are IOErrors, not the builtin ones.
+    if isinstance(error, (exceptions.ServerError, ConnectionError, aiohttp.ClientError,
+                          requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return "retryable"
+    return "fatal"
+
+
+def backoff_delays(base: float = 1.0, cap: float = 60.0):
+    # Decorrelated jitter: each sleep is drawn between base and three times the previous one.
+    delay = base
+    while True:
+        delay = min(cap, random.uniform(base, delay * 3))
+        yield delay
+
+
+def new_vm_stats() -> Dict[str, Any]:
+    return {"retries": 0, "backoff_seconds": 0.0}
+
+
+def record_backoff(stats: Optional[Dict[str, Any]], delay: float) -> None:
+    if stats is not None:
+        stats["retries"] += 1
+        stats["backoff_seconds"] += delay
+
+
+def with_retries(call, stats: Dict[str, Any] = None, attempts: int = RETRY_ATTEMPTS):
+    delays = backoff_delays()
+    for attempt in range(1, attempts + 1):
+        try:
+            return call()
+        except Exception as e:
+            if classify_error(e) != "retryable" or attempt == attempts:
+                raise
+            delay = next(delays)
+            record_backoff(stats, delay)
+            time.sleep(delay)
+
+
+def new_launch_id() -> str:
+    # Request IDs are derived from this, so a retried insert is deduplicated by GCE but a later launch is not.
+    return uuid.uuid4().hex
+
+
+def insert_request_id(launch_id: str, project_id: str, zone: str, instance_name: str, generation: int = 0) -> str:
+    # Same inputs, same ID: resending an insert whose response was lost can't create a second VM.
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{launch_id}/{project_id}/{zone}/{instance_name}/{generation}"))
+
+
+class LaunchJournal:
+    # Append-only JSONL log of every VM state change, fsynced line by line so a crash loses at most one event.
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a")
+
+    def record(self, event: Dict[str, Any]) -> None:
+        line = json.dumps({"time": time.time(), **event})
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+    @staticmethod
+    def replay(path: str) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+        # Returns the launch header and the last known state of every VM.
+        launch, states = {}, {}
+        with open(path) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # A line cut short by the crash.
+                    continue
+                if event.get("state") == "launch":
+                    launch = event
+                elif "vm" in event:
+                    states.setdefault(event["vm"], {}).update(event)
+        return launch, states
+
+
+_journal: Optional[LaunchJournal] = None
+
+
+def journal_event(vm_name: str, state: str, **fields) -> None:
+    if _journal is not None:
+        _journal.record({"vm": vm_name, "state": state, **fields})
+
+
+def resume_plan(vm_names: List[str], resume: Dict[str, Dict[str, Any]]) -> Tuple[
+        List[str], Dict[str, Dict[str, Any]], List[str], Dict[str, int]]:
+    # Splits a resumed range into VMs the journal saw finish (only read back), interrupted inserts (replayed with
+    # their request IDs in the same project and zone) and the rest, inserted anew. VMs whose insert failed
+    # start from the next generation: replaying a failed request ID would hand back the same failure.
+    done, in_flight, fresh, generations = [], {}, [], {}
+    for vm_name in vm_names:
+        state = resume.get(vm_name, {})
+        if state.get("state") == "done":
+            done.append(vm_name)
+        elif state.get("state") in ("inserting", "pending"):
+            in_flight[vm_name] = state
+            generations[vm_name] = state.get("generation", 0)
+        else:
+            fresh.append(vm_name)
+            if "request_id" in state:
+                generations[vm_name] = state.get("generation", 0) + 1
+    return done, in_flight, fresh, generations
+
+
+class NdjsonOutput:
+    # One JSON document per line, written and flushed as soon as each VM is up; shared by every worker thread.
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.emitted = set()
+        self._lock = threading.Lock()
+
+    def write(self, document: Dict[str, Any]) -> None:
+        with self._lock:
+            self.stream.write(json.dumps(document) + "\n")
+            self.stream.flush()
+
+    def vm(self, vm_name: str, result: Any, stats: Dict[str, Any] = None) -> None:
+        with self._lock:
+            if vm_name in self.emitted:
+                return
+            self.emitted.add(vm_name)
+        self.write(vm_document(vm_name, result, stats))
+
+
+def vm_document(vm_name: str, result: Any, stats: Dict[str, Any] = None) -> Dict[str, Any]:
+    stats = stats or {}
+    timings = {phase: round(stats[f"{phase}_seconds"], 1) for phase in ("insert", "running", "script", "ready")
+               if f"{phase}_seconds" in stats}
+    if isinstance(result, Exception):
+        return {"type": "vm", "name": vm_name, "status": "FAILED", "error": str(result), "timings": timings}
+    # .../projects/{project}/zones/{zone}
+    parts = result.zone.split("/")
+    interface = result.network_interfaces[0] if result.network_interfaces else None
+    return {"type": "vm", "name": vm_name, "project": parts[-3], "zone": parts[-1], "status": result.status,
+            "internal_ip": interface.network_i_p if interface else None,
+            "external_ip": interface.access_configs[0].nat_i_p if interface and interface.access_configs else None,
+            "ready_at": (time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(stats["ready_at"]))
+                         if "ready_at" in stats else None),
+            "timings": timings}
+
+
+_output: Optional[NdjsonOutput] = None
+
+
+def emit_vm(vm_name: str, result: Any, stats: Dict[str, Any] = None) -> None:
+    if _output is not None:
+        _output.vm(vm_name, result, stats)
+
+
+def build_instance(
         zone: str,
         instance_name: str,
         disks: List[compute_v1.AttachedDisk],
-        machine_type: str = "t2d-standard-1",
+        machine_type: str = DEFAULT_MACHINE_TYPE,
         network_link: str = "global/networks/default",
         subnetwork_link: str = None,
         internal_ip: str = None,
@@ -52,9 +422,8 @@ def create_instance(
         custom_hostname: str = None,
         delete_protection: bool = False,
         metadata: compute_v1.Metadata = None,  # Add metadata parameter here
+        labels: Dict[str, str] = None,
 ) -> compute_v1.Instance:
-    instance_client = compute_v1.InstancesClient()
-
     # Use the network interface provided in the network_link argument.
     network_interface = compute_v1.NetworkInterface()
     network_interface.name = network_link
@@ -82,10 +451,11 @@ def create_instance(
     # add port 80 443
     instance.tags = compute_v1.Tags(items=['http-server', 'https-server'])
 
-    if re.match(r"^zones/[a-z\d\-]+/machineTypes/[a-z\d\-]+$", machine_type):
-        instance.machine_type = machine_type
-    else:
-        instance.machine_type = f"zones/{zone}/machineTypes/{machine_type}"
+    # A zonal machine type URL is rewritten to this zone, so one config can fail over between zones.
+    match = re.match(r"^zones/[a-z\d\-]+/machineTypes/([a-z\d\-]+)$", machine_type)
+    if match:
+        machine_type = match.group(1)
+    instance.machine_type = f"zones/{zone}/machineTypes/{machine_type}"
 
     if accelerators:
         instance.guest_accelerators = accelerators
@@ -118,6 +488,27 @@ def create_instance(
         # Set the metadata for the instance
         instance.metadata = metadata
 
+    if labels:
+        instance.labels = labels
+
+    return instance
+
+
+def create_instance(
+        project_id: str,
+        zone: str,
+        instance_name: str,
+        disks: List[compute_v1.AttachedDisk],
+        fetch_instance: bool = True,
+        stats: Dict[str, Any] = None,
+        launch_id: str = None,
+        generation: int = 0,
+        **instance_kwargs,
+) -> compute_v1.Instance:
+    launch_id = launch_id or new_launch_id()
+    instance_client = get_client(compute_v1.InstancesClient, project_id)
+    instance = build_instance(zone, instance_name, disks, **instance_kwargs)
+
     # Prepare the request to insert an instance.
     request = compute_v1.InsertInstanceRequest()
     request.zone = zone
@@ -127,12 +518,200 @@ def create_instance(
     # Wait for the create operation to complete.
     print(f"Creating the {instance_name} instance in {zone}...")
 
-    operation = instance_client.insert(request=request)
+    def insert():
+        rate_limiter(project_id, "write").acquire()
+        return instance_client.insert(request=request)
 
-    wait_for_extended_operation(operation, "instance creation")
+    delays = backoff_delays()
+    for attempt in range(1, RETRY_ATTEMPTS + 1):
+        request.request_id = insert_request_id(launch_id, project_id, zone, instance_name, generation)
+        journal_event(instance_name, "inserting", project=project_id, zone=zone, request_id=request.request_id,
+                      generation=generation)
+        operation = with_retries(insert, stats)
+        journal_event(instance_name, "pending", operation=operation.name)
+        try:
+            wait_for_zone_operation(project_id, zone, operation, "instance creation")
+            break
+        except Exception as e:
+            if classify_error(e) != "retryable" or attempt == RETRY_ATTEMPTS:
+                raise
+            # Resending the same ID picks a timed-out operation up again; a failed one needs a fresh ID.
+            if not is_timeout(e):
+                generation += 1
+            delay = next(delays)
+            record_backoff(stats, delay)
+            time.sleep(delay)
 
+    journal_event(instance_name, "done")
     print(f"Instance {instance_name} created.")
-    return instance_client.get(project=project_id, zone=zone, instance=instance_name)
+    if not fetch_instance:
+        # The caller reads the whole fleet back in one list call instead.
+        instance.zone = f"projects/{project_id}/zones/{zone}"
+        return instance
+
+    def get():
+        rate_limiter(project_id, "read").acquire()
+        return instance_client.get(project=project_id, zone=zone, instance=instance_name)
+
+    return with_retries(get, stats)
+
+
+_image_lock = threading.Lock()
+# (image project, family) -> (image self-link, resolved_at)
+_images: Dict[Tuple[str, str], Tuple[str, float]] = {}
+_image_pins = 0
+
+
+@contextmanager
+def pinned_images():
+    # While a launch runs its resolved images do not expire, so a release mid-launch can't leave the fleet on
+    # mixed images; between launches they expire with the TTL, so long-lived callers pick up new releases.
+    global _image_pins
+    with _image_lock:
+        _image_pins += 1
+    try:
+        yield
+    finally:
+        with _image_lock:
+            _image_pins -= 1
+
+
+def resolve_image(image_project: str, image_family: str) -> str:
+    # Pin the family to one concrete image, in memory for the launch and on disk to save the lookup across runs
+    # within the TTL.
+    key = (image_project, image_family)
+    with _image_lock:
+        if key in _images and (_image_pins or time.time() - _images[key][1] < IMAGE_CACHE_TTL):
+            return _images[key][0]
+        cache_file = os.path.join(CACHE_DIR, "images.json")
+        try:
+            with open(cache_file) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+        entry = cached.get(f"{image_project}/{image_family}")
+        if entry and time.time() - entry["resolved_at"] < IMAGE_CACHE_TTL:
+            _images[key] = (entry["image"], entry["resolved_at"])
+            return entry["image"]
+
+        image = get_client(compute_v1.ImagesClient).get_from_family(project=image_project, family=image_family)
+        return _remember_image(image_project, image_family, f"projects/{image_project}/global/images/{image.name}")
+
+
+def _remember_image(image_project: str, image_family: str, image: str) -> str:
+    # Callers hold _image_lock. Overwrites both the in-memory pin and the disk cache entry for the family.
+    resolved_at = time.time()
+    _images[(image_project, image_family)] = (image, resolved_at)
+    cache_file = os.path.join(CACHE_DIR, "images.json")
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = {}
+    cached[f"{image_project}/{image_family}"] = {"image": image, "resolved_at": resolved_at}
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(f"{cache_file}.tmp", "w") as f:
+            json.dump(cached, f, indent=2)
+        os.replace(f"{cache_file}.tmp", cache_file)
+    except OSError as e:
+        print(f"Could not write image cache {cache_file}: {e}", file=sys.stderr, flush=True)
+    return image
+
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS refreshed (project TEXT, kind TEXT, refreshed_at REAL, PRIMARY KEY (project, kind));
+CREATE TABLE IF NOT EXISTS zones (project TEXT, name TEXT, region TEXT, status TEXT, PRIMARY KEY (project, name));
+CREATE TABLE IF NOT EXISTS machine_types (project TEXT, zone TEXT, name TEXT, guest_cpus INTEGER, memory_mb INTEGER,
+                                          PRIMARY KEY (project, zone, name));
+CREATE TABLE IF NOT EXISTS disk_types (project TEXT, zone TEXT, name TEXT, PRIMARY KEY (project, zone, name));
+CREATE TABLE IF NOT EXISTS image_families (project TEXT, family TEXT, image TEXT, created TEXT,
+                                           PRIMARY KEY (project, family));
+"""
+_catalog_lock = threading.Lock()
+
+
+def _catalog() -> sqlite3.Connection:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    db = sqlite3.connect(os.path.join(CACHE_DIR, "catalog.sqlite3"))
+    db.executescript(CATALOG_SCHEMA)
+    return db
+
+
+def _fetch_catalog(project_id: str, kind: str) -> List[tuple]:
+    if kind == "zones":
+        client = get_client(compute_v1.ZonesClient, project_id)
+        return [(project_id, zone.name, zone.region.rsplit("/", 1)[-1], zone.status)
+                for zone in client.list(project=project_id)]
+    if kind == "machine_types":
+        client = get_client(compute_v1.MachineTypesClient, project_id)
+        request = compute_v1.AggregatedListMachineTypesRequest(project=project_id, return_partial_success=True)
+        return [(project_id, scope.rsplit("/", 1)[-1], machine_type.name, machine_type.guest_cpus,
+                 machine_type.memory_mb)
+                for scope, scoped_list in client.aggregated_list(request=request)
+                for machine_type in scoped_list.machine_types]
+    if kind == "disk_types":
+        client = get_client(compute_v1.DiskTypesClient, project_id)
+        request = compute_v1.AggregatedListDiskTypesRequest(project=project_id, return_partial_success=True)
+        return [(project_id, scope.rsplit("/", 1)[-1], disk_type.name)
+                for scope, scoped_list in client.aggregated_list(request=request)
+                for disk_type in scoped_list.disk_types if scope.startswith("zones/")]
+    # Image families live in the image project; keep the newest non-deprecated image of each.
+    newest = {}
+    for image in get_client(compute_v1.ImagesClient, project_id).list(project=project_id):
+        if image.family and image.deprecated.state not in ("DEPRECATED", "OBSOLETE", "DELETED"):
+            if image.family not in newest or image.creation_timestamp > newest[image.family][3]:
+                newest[image.family] = (project_id, image.family, image.name, image.creation_timestamp)
+    return list(newest.values())
+
+
+def refresh_catalog(project_id: str, kinds: List[str], force: bool = False) -> None:
+    # Each (project, kind) is refreshed on its own TTL, so a stale entry costs one list call and fresh ones none.
+    placeholders = {"zones": 4, "machine_types": 5, "disk_types": 3, "image_families": 4}
+    with _catalog_lock, closing(_catalog()) as db:
+        for kind in kinds:
+            row = db.execute("SELECT refreshed_at FROM refreshed WHERE project = ? AND kind = ?",
+                             (project_id, kind)).fetchone()
+            if row and not force and time.time() - row[0] < CATALOG_TTL:
+                continue
+            rate_limiter(project_id, "read").acquire()
+            rows = _fetch_catalog(project_id, kind)
+            with db:
+                db.execute(f"DELETE FROM {kind} WHERE project = ?", (project_id,))
+                db.executemany(f"INSERT OR REPLACE INTO {kind} VALUES ({', '.join('?' * placeholders[kind])})", rows)
+                db.execute("INSERT OR REPLACE INTO refreshed VALUES (?, ?, ?)", (project_id, kind, time.time()))
+
+
+def catalog_names(project_id: str, kind: str, prefix: str = "", zone: str = None) -> List[str]:
+    # Autocompletion straight from the local catalog; refresh_catalog() keeps it current.
+    column = "family" if kind == "image_families" else "name"
+    query = f"SELECT DISTINCT {column} FROM {kind} WHERE project = ? AND {column} LIKE ?"
+    args = [project_id, f"{prefix}%"]
+    if zone and kind in ("machine_types", "disk_types"):
+        query += " AND zone = ?"
+        args.append(zone)
+    with _catalog_lock, closing(_catalog()) as db:
+        return [row[0] for row in db.execute(query + f" ORDER BY {column}", args)]
+
+
+def _check_name(kind: str, name: str, known: List[str], where: str = "") -> None:
+    if name not in known:
+        suggestions = difflib.get_close_matches(name, known, n=3)
+        hint = f" Did you mean {', '.join(suggestions)}?" if suggestions else ""
+        raise ValueError(f"Unknown {kind} {name}{where}.{hint}")
+
+
+def validate_launch(project_id: str, zones: List[str], image_project: str, image_family: str,
+                    machine_type: str = DEFAULT_MACHINE_TYPE, disk_type: str = DEFAULT_DISK_TYPE) -> None:
+    # Catch typos before the first insert instead of after hundreds of them fail.
+    refresh_catalog(project_id, ["zones", "machine_types", "disk_types"])
+    refresh_catalog(image_project, ["image_families"])
+    known_zones = catalog_names(project_id, "zones")
+    for zone in zones:
+        _check_name("zone", zone, known_zones)
+        _check_name("machine type", machine_type, catalog_names(project_id, "machine_types", zone=zone), f" in {zone}")
+        _check_name("disk type", disk_type, catalog_names(project_id, "disk_types", zone=zone), f" in {zone}")
+    _check_name("image family", image_family, catalog_names(image_project, "image_families"), f" in {image_project}")
 
 
 def disk_from_image(
@@ -145,7 +724,7 @@ def disk_from_image(
 ) -> compute_v1.AttachedDisk():
     disk = compute_v1.AttachedDisk()
     initialize_params = compute_v1.AttachedDiskInitializeParams()
-    initialize_params.source_image = f"projects/{image_project}/global/images/family/{image_family}"
+    initialize_params.source_image = resolve_image(image_project, image_family)
     initialize_params.disk_type = disk_type
     initialize_params.disk_size_gb = disk_size_gb
     disk.initialize_params = initialize_params
@@ -156,72 +735,2064 @@ def disk_from_image(
     return disk
 
 
-def create_from_image(
-        project_id: str, zone: str, instance_name: str, image_project: str, image_family: str,
-        startup_script: str = None
-):
-    disk_type = f"zones/{zone}/diskTypes/pd-standard"
+def image_boot_disks(zone: str, image_project: str, image_family: str) -> List[compute_v1.AttachedDisk]:
+    disk_type = f"zones/{zone}/diskTypes/{DEFAULT_DISK_TYPE}"
     disks = [compute_v1.AttachedDisk()]
     disks[0].boot = True
     disks[0].auto_delete = True
     disks[0].initialize_params = compute_v1.AttachedDiskInitializeParams()
-    disks[0].initialize_params.source_image = f"projects/{image_project}/global/images/family/{image_family}"
+    disks[0].initialize_params.source_image = resolve_image(image_project, image_family)
     disks[0].initialize_params.disk_type = disk_type
-    disks[0].initialize_params.disk_size_gb = 10
+    disks[0].initialize_params.disk_size_gb = DEFAULT_DISK_SIZE_GB
+    return disks
+
+
+def disk_from_snapshot(
+        disk_type: str, source_snapshot: str, boot: bool = True, auto_delete: bool = True, disk_size_gb: int = None
+) -> compute_v1.AttachedDisk:
+    disk = compute_v1.AttachedDisk()
+    initialize_params = compute_v1.AttachedDiskInitializeParams()
+    initialize_params.source_snapshot = source_snapshot
+    initialize_params.disk_type = disk_type
+    # Left unset, the disk gets the snapshot's size.
+    if disk_size_gb:
+        initialize_params.disk_size_gb = disk_size_gb
+    disk.initialize_params = initialize_params
+    disk.auto_delete = auto_delete
+    disk.boot = boot
+    return disk
+
+
+def snapshot_boot_disks(zone: str, source_snapshot: str) -> List[compute_v1.AttachedDisk]:
+    return [disk_from_snapshot(f"zones/{zone}/diskTypes/{DEFAULT_DISK_TYPE}", source_snapshot)]
+
+
+def global_resource(project_id: str, kind: str, name: str) -> str:
+    # "my-snapshot" -> projects/{project}/global/snapshots/my-snapshot; full paths are kept as they are.
+    return name if "/" in name else f"projects/{project_id}/global/{kind}/{name}"
+
+
+def readiness_wrapper(startup_script: str) -> str:
+    # Publishes "started", then "service-up" or "failed" once the script exits. The script can report its own
+    # steps in between with the vm-phase helper, e.g. `vm-phase packages-installed`.
+    return f"""#!/bin/bash
+cat > /usr/local/bin/vm-phase <<'CREATE_GCP_VMS_PHASE'
+#!/bin/bash
+curl -s -X PUT --data "$1" -H "Metadata-Flavor: Google" \\
+  http://metadata.google.internal/computeMetadata/v1/instance/guest-attributes/{READY_NAMESPACE}/phase
+CREATE_GCP_VMS_PHASE
+chmod +x /usr/local/bin/vm-phase
+vm-phase started
+cat > /var/tmp/create-gcp-vms-startup <<'CREATE_GCP_VMS_STARTUP'
+{startup_script}
+CREATE_GCP_VMS_STARTUP
+chmod +x /var/tmp/create-gcp-vms-startup
+if /var/tmp/create-gcp-vms-startup; then
+  vm-phase service-up
+else
+  vm-phase failed
+fi
+"""
+
+
+def startup_metadata(startup_script: str = None) -> Optional[compute_v1.Metadata]:
+    if not startup_script:
+        return None
+    metadata = compute_v1.Metadata()
+
+    items = compute_v1.types.Items()
+    items.key = "startup-script"
+    items.value = readiness_wrapper(startup_script)
+    guest_attributes = compute_v1.types.Items()
+    guest_attributes.key = "enable-guest-attributes"
+    guest_attributes.value = "TRUE"
+    metadata.items = [items, guest_attributes]
+    return metadata
+
+
+def create_from_image(
+        project_id: str, zone: str, instance_name: str, image_project: str, image_family: str,
+        startup_script: str = None, fetch_instance: bool = True, stats: Dict[str, Any] = None,
+        launch_id: str = None, generation: int = 0
+):
+    disks = image_boot_disks(zone, image_project, image_family)
+    metadata = startup_metadata(startup_script)
+    return create_instance(project_id, zone, instance_name, disks, fetch_instance, stats, launch_id, generation,
+                           metadata=metadata)
+
+
+def baked_family(image_project: str, image_family: str, startup_script: str) -> str:
+    # The base image is part of the key too: the same script baked on another distribution is another image.
+    digest = hashlib.sha256(f"{image_project}/{image_family}\n{startup_script}".encode()).hexdigest()
+    return f"baked-{digest[:16]}"
+
+
+def find_baked_image(project_id: str, family: str) -> Optional[str]:
+    try:
+        return resolve_image(project_id, family)
+    except exceptions.NotFound:
+        return None
+
+
+def bake_wrapper(startup_script: str) -> str:
+    # The builder powers itself off only if the script succeeded, so TERMINATED means "ready to image".
+    return f"""#!/bin/bash
+cat > /var/tmp/create-gcp-vms-bake <<'CREATE_GCP_VMS_BAKE'
+{startup_script}
+CREATE_GCP_VMS_BAKE
+chmod +x /var/tmp/create-gcp-vms-bake
+if /var/tmp/create-gcp-vms-bake; then
+  shutdown -h now
+fi
+"""
+
+
+def bake_image(project_id: str, zone: str, image_project: str, image_family: str, startup_script: str,
+               timeout: int = 1800, force: bool = False) -> str:
+    family = baked_family(image_project, image_family, startup_script)
+    if not force:
+        image = find_baked_image(project_id, family)
+        if image:
+            print(f"Image family {family} is already baked: {image}")
+            return image
+
+    builder = f"bake-{family[len('baked-'):]}"
+    instance_client = get_client(compute_v1.InstancesClient, project_id)
+    # On-demand, not spot: a preemption halfway through the script would image a half-installed disk.
+    instance = create_instance(project_id, zone, builder, image_boot_disks(zone, image_project, image_family),
+                               metadata=startup_metadata(bake_wrapper(startup_script)), spot=False)
+    print(f"Waiting up to {timeout} seconds for the startup script on {builder} to finish...")
+    deadline = time.monotonic() + timeout
+    while instance.status != "TERMINATED":
+        if time.monotonic() > deadline:
+            # Left running so its serial console shows what went wrong.
+            raise TimeoutError(f"The startup script on {builder} did not finish in {timeout} seconds; "
+                               f"{builder} is left running for inspection.")
+        time.sleep(15)
+        rate_limiter(project_id, "read").acquire()
+        instance = with_retries(lambda: instance_client.get(project=project_id, zone=zone, instance=builder))
+
+    try:
+        image = compute_v1.Image()
+        image.name = f"{family}-{time.strftime('%Y%m%d%H%M%S')}"
+        image.family = family
+        image.source_disk = instance.disks[0].source
+        image.description = f"{image_project}/{image_family} with a startup script baked in by create_gcp_vms."
+        print(f"Creating image {image.name} in family {family}...")
+        rate_limiter(project_id, "write").acquire()
+        operation = get_client(compute_v1.ImagesClient, project_id).insert(project=project_id, image_resource=image)
+        wait_for_extended_operation(operation, "image creation", timeout=timeout)
+    finally:
+        rate_limiter(project_id, "write").acquire()
+        wait_for_extended_operation(instance_client.delete(project=project_id, zone=zone, instance=builder),
+                                    "builder deletion")
+    # Record the new image directly: a lookup could still answer with the previous image from the caches.
+    with _image_lock:
+        baked = _remember_image(project_id, family, f"projects/{project_id}/global/images/{image.name}")
+    refresh_catalog(project_id, ["image_families"], force=True)
+    print(f"Baked image family {family}; launches with the same base image and script will boot from it.")
+    return baked
+
+
+def name_filter(vm_names: List[str]) -> str:
+    # Match on the longest common prefix; callers drop any extra names the regex lets through.
+    prefix = vm_names[0]
+    for vm_name in vm_names[1:]:
+        while not vm_name.startswith(prefix):
+            prefix = prefix[:-1]
+    return f'name eq "{re.escape(prefix)}.*"'
+
+
+def fleet_snapshot(project_id: str, vm_names: List[str]) -> Dict[str, compute_v1.Instance]:
+    # One aggregatedList across every zone gives a consistent view of status and IPs for the whole fleet.
+    instance_client = get_client(compute_v1.InstancesClient, project_id)
+    request = compute_v1.AggregatedListInstancesRequest()
+    request.project = project_id
+    request.filter = name_filter(vm_names)
+    request.return_partial_success = True
+    wanted = set(vm_names)
+    snapshot = {}
+
+    def list_page():
+        # Each page is its own call, so each one takes a read token; the pager's first page is the response.
+        rate_limiter(project_id, "read").acquire()
+        return next(iter(instance_client.aggregated_list(request=request).pages))
+
+    while True:
+        page = with_retries(list_page)
+        for scoped_list in page.items.values():
+            for instance in scoped_list.instances:
+                if instance.name in wanted:
+                    snapshot[instance.name] = instance
+        if not page.next_page_token:
+            return snapshot
+        request.page_token = page.next_page_token
+
+
+class ZonePlacement:
+    # Spreads VM names over zones and steers retries away from zones that ran out of capacity.
+
+    def __init__(self, zones: List[str], policy: str = "spread", weights: Dict[str, float] = None):
+        self.zones = zones
+        self.policy = policy
+        self.weights = weights or {}
+        self.exhausted = set()
+        # VMs that must go back to a given zone, e.g. to replay their insert request IDs on resume.
+        self.pinned: Dict[str, str] = {}
+        # The insert generation each VM starts from; on resume, past the request IDs its failed attempts used.
+        self.generations: Dict[str, int] = {}
+
+    def assign(self, vm_names: List[str]) -> Dict[str, str]:
+        assigned = self._assign([vm_name for vm_name in vm_names if vm_name not in self.pinned])
+        assigned.update({vm_name: self.pinned[vm_name] for vm_name in vm_names if vm_name in self.pinned})
+        return assigned
+
+    def _assign(self, vm_names: List[str]) -> Dict[str, str]:
+        if self.policy == "fill-first":
+            return {vm_name: self.zones[0] for vm_name in vm_names}
+        # Smooth weighted round robin; spread is the equal-weight case.
+        weights = {zone: self.weights.get(zone, 1.0) if self.policy == "weighted" else 1.0 for zone in self.zones}
+        total = sum(weights.values())
+        current = {zone: 0.0 for zone in self.zones}
+        assigned = {}
+        for vm_name in vm_names:
+            for zone in self.zones:
+                current[zone] += weights[zone]
+            zone = max(self.zones, key=current.get)
+            current[zone] -= total
+            assigned[vm_name] = zone
+        return assigned
+
+    def next_zone(self, preferred: str, tried: set) -> Optional[str]:
+        zones = self.zones if preferred in self.zones else [preferred] + self.zones
+        start = zones.index(preferred)
+        for zone in zones[start:] + zones[:start]:
+            if zone not in tried and zone not in self.exhausted:
+                return zone
+        return None
+
+    def mark_exhausted(self, zone: str) -> None:
+        if zone not in self.exhausted:
+            print(f"Zone {zone} is out of capacity, failing over to the next zone.", file=sys.stderr, flush=True)
+            self.exhausted.add(zone)
+
+
+def parse_zones(zones: str) -> Tuple[List[str], Dict[str, float]]:
+    # "us-central1-a:3,us-central1-b" -> zones in order plus their weights (default 1).
+    names, weights = [], {}
+    for item in zones.split(","):
+        name, _, weight = item.strip().partition(":")
+        if name:
+            names.append(name)
+            weights[name] = float(weight) if weight else 1.0
+    return names, weights
+
+
+def create_from_image_failover(project_id: str, placement: ZonePlacement, preferred_zone: str, instance_name: str,
+                               image_project: str, image_family: str, startup_script: str = None,
+                               fetch_instance: bool = True, stats: Dict[str, Any] = None, launch_id: str = None):
+    tried = set()
+    zone = placement.next_zone(preferred_zone, tried)
+    error = RuntimeError(f"No zone with capacity left for {instance_name}.")
+    while zone:
+        try:
+            return create_from_image(project_id, zone, instance_name, image_project, image_family, startup_script,
+                                     fetch_instance, stats, launch_id, placement.generations.get(instance_name, 0))
+        except Exception as e:
+            if classify_error(e) != "stockout":
+                raise
+            placement.mark_exhausted(zone)
+            error = e
+        tried.add(zone)
+        zone = placement.next_zone(preferred_zone, tried)
+    raise error
+
+
+def instance_properties_from(instance: compute_v1.Instance) -> compute_v1.InstanceProperties:
+    # Bulk insert and instance templates take InstanceProperties, which want the bare machine type name
+    # instead of a zonal URL.
+    properties = compute_v1.InstanceProperties()
+    properties.machine_type = instance.machine_type.rsplit("/", 1)[-1]
+    # Same for the disk type, so the properties work in any zone.
+    disks = [compute_v1.AttachedDisk(disk) for disk in instance.disks]
+    for disk in disks:
+        if disk.initialize_params.disk_type:
+            disk.initialize_params.disk_type = disk.initialize_params.disk_type.rsplit("/", 1)[-1]
+    properties.disks = disks
+    properties.network_interfaces = instance.network_interfaces
+    properties.tags = instance.tags
+    if instance.guest_accelerators:
+        properties.guest_accelerators = instance.guest_accelerators
+    if "scheduling" in instance:
+        properties.scheduling = instance.scheduling
+    if "metadata" in instance:
+        properties.metadata = instance.metadata
+    return properties
+
+
+_template_lock = threading.Lock()
+_templates: Dict[Tuple[str, str], str] = {}
 
-    if startup_script:
-        metadata = compute_v1.Metadata()
 
-        items = compute_v1.types.Items()
-        items.key = "startup-script"
-        items.value = startup_script
-        metadata.items = [items]
-        instance = create_instance(project_id, zone, instance_name, disks, metadata=metadata)
+def ensure_template(project_id: str, zone: str, image_project: str, image_family: str,
+                    startup_script: str = None) -> str:
+    # The template is named after a hash of its properties: an unchanged config reuses it across launches,
+    # a changed one (new script, new pinned image) gets a new template.
+    disks = image_boot_disks(zone, image_project, image_family)
+    properties = instance_properties_from(
+        build_instance(zone, "template", disks, metadata=startup_metadata(startup_script)))
+    digest = hashlib.sha256(json_format.MessageToJson(compute_v1.InstanceProperties.pb(properties),
+                                                      sort_keys=True).encode()).hexdigest()
+    name = f"create-gcp-vms-{digest[:16]}"
+    with _template_lock:
+        if (project_id, name) in _templates:
+            return _templates[(project_id, name)]
+        client = get_client(compute_v1.InstanceTemplatesClient, project_id)
+        try:
+            rate_limiter(project_id, "read").acquire()
+            client.get(project=project_id, instance_template=name)
+            print(f"Reusing instance template {name}.")
+        except exceptions.NotFound:
+            print(f"Creating instance template {name}...")
+            template = compute_v1.InstanceTemplate()
+            template.name = name
+            template.properties = properties
+            rate_limiter(project_id, "write").acquire()
+            try:
+                operation = client.insert(project=project_id, instance_template_resource=template)
+                wait_for_extended_operation(operation, "instance template creation")
+            except exceptions.Conflict:
+                # Another launch with the same config got there first; it is the same template.
+                pass
+        _templates[(project_id, name)] = f"projects/{project_id}/global/instanceTemplates/{name}"
+        return _templates[(project_id, name)]
+
+
+class BulkShortfall(RuntimeError):
+    # The bulk insert finished but created fewer VMs than asked; with min_count 1 that means the zone ran dry.
+    pass
+
+
+def bulk_create_vms(project_id: str, zone: str, vm_names: List[str], image_project: str, image_family: str,
+                    startup_script: str = None, use_template: bool = False, launch_id: str = None,
+                    generation: int = 0) -> Dict[str, Any]:
+    launch_id = launch_id or new_launch_id()
+    instance_client = get_client(compute_v1.InstancesClient, project_id)
+
+    def list_zone() -> Dict[str, compute_v1.Instance]:
+        # The operation only carries counts, so listing the zone is how to tell which names exist.
+        wanted = set(vm_names)
+        list_request = compute_v1.ListInstancesRequest()
+        list_request.project = project_id
+        list_request.zone = zone
+        list_request.filter = name_filter(vm_names)
+        rate_limiter(project_id, "read").acquire()
+        return {instance.name: instance for instance in instance_client.list(request=list_request)
+                if instance.name in wanted}
+
+    # Names taken before the insert were not created by it, and with them in the request the whole bulk insert
+    # would fail on alreadyExists.
+    before = list_zone()
+    results = {}
+    for name in vm_names:
+        if name in before:
+            results[name] = exceptions.Conflict(f"Instance {name} already existed before the bulk insert.")
+            journal_event(name, "failed", error=str(results[name]))
+    new_names = [name for name in vm_names if name not in before]
+    if not new_names:
+        print(f"Bulk insert in {zone}: all {len(vm_names)} instances already exist.", file=sys.stderr, flush=True)
+        return results
+
+    resource = compute_v1.BulkInsertInstanceResource()
+    resource.count = len(new_names)
+    # Accept partial fleets; whatever could not be created is reported as failed below.
+    resource.min_count = 1
+    if use_template:
+        resource.source_instance_template = ensure_template(project_id, zone, image_project, image_family,
+                                                            startup_script)
     else:
-        instance = create_instance(project_id, zone, instance_name, disks)
-    return instance
+        # Every VM shares the instance built for create_instance; only the names differ.
+        disks = image_boot_disks(zone, image_project, image_family)
+        template = build_instance(zone, new_names[0], disks, metadata=startup_metadata(startup_script))
+        resource.instance_properties = instance_properties_from(template)
+    # Explicit names keep the vm-1, vm-2, ... scheme, which a '#' name_pattern cannot express.
+    resource.per_instance_properties = {
+        name: compute_v1.BulkInsertInstanceResourcePerInstanceProperties() for name in new_names
+    }
+
+    request = compute_v1.BulkInsertInstanceRequest()
+    request.project = project_id
+    request.zone = zone
+    request.bulk_insert_instance_resource_resource = resource
+    request.request_id = insert_request_id(launch_id, project_id, zone,
+                                           f"bulk/{vm_names[0]}/{vm_names[-1]}/{len(vm_names)}", generation)
+
+    def bulk_insert():
+        rate_limiter(project_id, "write").acquire()
+        return instance_client.bulk_insert(request=request)
+
+    print(f"Bulk creating {len(new_names)} instances in {zone}...")
+    for name in new_names:
+        journal_event(name, "inserting", project=project_id, zone=zone, request_id=request.request_id,
+                      generation=generation)
+    error = None
+    try:
+        operation = with_retries(bulk_insert)
+        while True:
+            try:
+                # GCE works through a bulk insert in batches, so a few hundred VMs take far longer than one insert.
+                wait_for_zone_operation(project_id, zone, operation, "bulk instance creation",
+                                        timeout=300 + 6 * len(new_names))
+                break
+            except Exception as e:
+                # Still running: giving up now would let the next zone insert the same names a second time.
+                if not is_timeout(e):
+                    raise
+                print(f"Bulk insert in {zone} is still running, waiting for it again...", flush=True)
+    except Exception as e:
+        error = e
+
+    existing = list_zone()
+    for name in new_names:
+        if name in existing:
+            results[name] = existing[name]
+            journal_event(name, "done")
+        else:
+            results[name] = error or BulkShortfall(f"Instance {name} was not created by bulk insert.")
+            journal_event(name, "failed", error=str(results[name]))
+    results = {name: results[name] for name in vm_names}
+    created = [name for name in new_names if name in existing]
+    failed = [name for name in vm_names if name not in created]
+    print(f"Bulk insert in {zone}: {len(created)} created, {len(failed)} failed.")
+    for name in failed:
+        print(f" - {name}: {results[name]}", file=sys.stderr, flush=True)
+    return results
+
+
+def bulk_create_fleet(project_id: str, placement: ZonePlacement, vm_names: List[str], image_project: str,
+                      image_family: str, startup_script: str = None, use_template: bool = False,
+                      launch_id: str = None) -> Dict[str, Any]:
+    # One bulk insert per zone; names a zone could not fit are bulk inserted again in the next zone.
+    launch_id = launch_id or new_launch_id()
+    pending = placement.assign(vm_names)
+    tried = {vm_name: set() for vm_name in vm_names}
+    results = {}
+    while pending:
+        by_zone = {}
+        for vm_name, zone in pending.items():
+            by_zone.setdefault(zone, []).append(vm_name)
+        pending = {}
+        for zone, names in by_zone.items():
+            zone_results = bulk_create_vms(project_id, zone, names, image_project, image_family, startup_script,
+                                           use_template, launch_id,
+                                           max(placement.generations.get(name, 0) for name in names))
+            results.update(zone_results)
+            # Only a stockout or a partial fill moves names on; after any other error (a timeout in particular)
+            # the operation may still be creating them in this zone, and a name that already existed stays put.
+            failed = [name for name in names if isinstance(zone_results[name], Exception)
+                      and (classify_error(zone_results[name]) == "stockout"
+                           or isinstance(zone_results[name], BulkShortfall))]
+            if not failed:
+                continue
+            placement.mark_exhausted(zone)
+            for name in failed:
+                tried[name].add(zone)
+                next_zone = placement.next_zone(zone, tried[name])
+                if next_zone:
+                    pending[name] = next_zone
+    return {vm_name: results[vm_name] for vm_name in vm_names}
+
+
+class AsyncComputeClient:
+    # Minimal async transport for the Compute REST API, covering what the provisioning engine needs.
+
+    def __init__(self, session: aiohttp.ClientSession, credentials=None):
+        self.session = session
+        self.credentials = credentials or shared_credentials()
+        self._refresh_lock = asyncio.Lock()
+
+    async def _token(self) -> str:
+        async with self._refresh_lock:
+            if not self.credentials.valid:
+                # google-auth refreshes synchronously; keep it off the event loop.
+                await asyncio.get_running_loop().run_in_executor(None, self.credentials.refresh, Request())
+            return self.credentials.token
+
+    async def call(self, method: str, path: str, params: Dict[str, Any] = None, body: Dict[str, Any] = None) -> dict:
+        # Paths look like /projects/{project}/...; zoneOperations.wait is a POST but counts against reads.
+        call_class = "read" if method == "GET" or path.endswith("/wait") else "write"
+        await rate_limiter(path.split("/")[2], call_class).acquire_async()
+        headers = {"Authorization": f"Bearer {await self._token()}"}
+        async with self.session.request(method, f"{COMPUTE_API}{path}", params=params, json=body,
+                                        headers=headers) as response:
+            if response.status >= 400:
+                # Front ends answer 502 and 503 with an HTML page, so only an API error comes as JSON.
+                text = await response.text()
+                try:
+                    error = json.loads(text).get("error", {})
+                except (ValueError, AttributeError):
+                    error = {}
+                raise exceptions.from_http_status(response.status, error.get("message") or response.reason or text,
+                                                  errors=error.get("errors", []))
+            return await response.json(content_type=None) or {}
+
+    async def insert_instance(self, project_id: str, zone: str, instance: compute_v1.Instance,
+                              request_id: str = None, source: Dict[str, str] = None) -> dict:
+        body = json_format.MessageToDict(compute_v1.Instance.pb(instance))
+        # source is sourceInstanceTemplate or sourceMachineImage, which supply everything the body leaves out.
+        params = dict(source or {})
+        if request_id:
+            params["requestId"] = request_id
+        return await self.call("POST", f"/projects/{project_id}/zones/{zone}/instances", params=params or None,
+                               body=body)
+
+    async def instance_action(self, project_id: str, zone: str, instance_name: str, action: str,
+                              request_id: str = None) -> dict:
+        # delete is a DELETE of the instance; stop, start, suspend and resume are POSTs on it.
+        path = f"/projects/{project_id}/zones/{zone}/instances/{instance_name}"
+        params = {"requestId": request_id} if request_id else None
+        if action == "delete":
+            return await self.call("DELETE", path, params=params)
+        return await self.call("POST", f"{path}/{action}", params=params)
+
+    async def guest_attributes(self, project_id: str, zone: str, instance_name: str,
+                               query_path: str) -> Dict[str, str]:
+        payload = await self.call("GET", f"/projects/{project_id}/zones/{zone}/instances/{instance_name}/"
+                                         f"getGuestAttributes", params={"queryPath": query_path})
+        return {item["key"]: item["value"] for item in payload.get("queryValue", {}).get("items", [])}
+
+    async def serial_output(self, project_id: str, zone: str, instance_name: str, start: int = 0) -> dict:
+        return await self.call("GET", f"/projects/{project_id}/zones/{zone}/instances/{instance_name}/serialPort",
+                               params={"port": 1, "start": start})
+
+    async def get_instance(self, project_id: str, zone: str, instance_name: str) -> compute_v1.Instance:
+        payload = await self.call("GET", f"/projects/{project_id}/zones/{zone}/instances/{instance_name}")
+        return compute_v1.Instance.from_json(json.dumps(payload), ignore_unknown_fields=True)
+
+    async def aggregated_list_instances(self, project_id: str, filter_: str = None) -> List[compute_v1.Instance]:
+        params = {"returnPartialSuccess": "true", "maxResults": 500}
+        if filter_:
+            params["filter"] = filter_
+        instances = []
+        while True:
+            page = await self.call("GET", f"/projects/{project_id}/aggregated/instances", params=params)
+            for scoped_list in page.get("items", {}).values():
+                for payload in scoped_list.get("instances", []):
+                    instances.append(compute_v1.Instance.from_json(json.dumps(payload), ignore_unknown_fields=True))
+            if not page.get("nextPageToken"):
+                return instances
+            params["pageToken"] = page["nextPageToken"]
+
+    async def wait_operation(self, project_id: str, zone: str, operation: dict, verbose_name: str = "operation",
+                             timeout: int = 300) -> dict:
+        deadline = time.monotonic() + timeout
+        while operation.get("status") != "DONE":
+            if time.monotonic() > deadline:
+                raise asyncio.TimeoutError(f"{verbose_name} did not finish in {timeout} seconds")
+            # zoneOperations.wait long-polls server side, so each loop costs one request per ~2 minutes.
+            operation = await self.call("POST", f"/projects/{project_id}/zones/{zone}/operations/"
+                                                f"{operation['name']}/wait")
+        return check_operation(operation, verbose_name)
+
+
+def check_operation(operation: dict, verbose_name: str = "operation") -> dict:
+    # REST counterpart of wait_for_extended_operation's error and warning handling.
+    if "error" in operation:
+        errors = operation["error"].get("errors", [])
+        message = "; ".join(f"{error.get('code')}: {error.get('message')}" for error in errors)
+        print(f"Error during {verbose_name}: [Code: {operation.get('httpErrorStatusCode')}]: {message}",
+              file=sys.stderr, flush=True)
+        print(f"Operation ID: {operation.get('name')}", file=sys.stderr, flush=True)
+        raise exceptions.from_http_status(operation.get("httpErrorStatusCode", 400),
+                                          message or operation.get("httpErrorMessage", ""), errors=errors)
+
+    if operation.get("warnings"):
+        print(f"Warnings during {verbose_name}:\n", file=sys.stderr, flush=True)
+        for warning in operation["warnings"]:
+            print(f" - {warning.get('code')}: {warning.get('message')}", file=sys.stderr, flush=True)
+
+    return operation
+
+
+class AimdController:
+    # Additive-increase / multiplicative-decrease window on the number of inserts in flight.
+
+    def __init__(self, maximum: int = 32, initial: int = None, minimum: int = 1, decrease: float = 0.5):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.decrease = decrease
+        self.window = float(initial or maximum)
+        self.lowest_window = self.window
+        self.in_flight = 0
+        self.successes = 0
+        self.rate_limited = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.window))
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def on_success(self) -> None:
+        self.successes += 1
+        # +1 slot per full window of successes, i.e. roughly one per round trip.
+        self.window = min(self.maximum, self.window + 1 / self.window)
+
+    def on_rate_limited(self, started: float) -> None:
+        self.rate_limited += 1
+        # Calls that were already in flight when we last backed off report the same congestion; count it once.
+        if started < self._last_decrease:
+            return
+        self.window = max(self.minimum, self.window * self.decrease)
+        self.lowest_window = min(self.lowest_window, self.window)
+        self._last_decrease = time.monotonic()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"window": round(self.window, 1), "lowest_window": round(self.lowest_window, 1),
+                "in_flight": self.in_flight, "successes": self.successes, "rate_limited": self.rate_limited}
+
+
+async def with_retries_async(call, controller: AimdController = None, stats: Dict[str, Any] = None,
+                             attempts: int = RETRY_ATTEMPTS):
+    delays = backoff_delays()
+    for attempt in range(1, attempts + 1):
+        started = time.monotonic()
+        try:
+            return await call()
+        except Exception as e:
+            if controller and is_rate_limited(e):
+                controller.on_rate_limited(started)
+            if classify_error(e) != "retryable" or attempt == attempts:
+                raise
+            delay = next(delays)
+            record_backoff(stats, delay)
+            await asyncio.sleep(delay)
+
+
+class OperationPoller:
+    # Tracks every pending zone operation and resolves them with one filtered zoneOperations.list per batch,
+    # instead of a long-poll per VM.
+
+    def __init__(self, client: AsyncComputeClient, interval: float = 5.0, batch_size: int = 50):
+        self.client = client
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pending: Dict[Tuple[str, str], Dict[str, asyncio.Future]] = {}
+        self.requests = 0
+        self.resolved = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def wait(self, project_id: str, zone: str, operation: dict, verbose_name: str = "operation",
+                   timeout: int = 300) -> dict:
+        name = operation["name"]
+        if operation.get("status") != "DONE":
+            future = asyncio.get_running_loop().create_future()
+            self.pending.setdefault((project_id, zone), {})[name] = future
+            if self._task is None or self._task.done():
+                self._task = asyncio.create_task(self._run())
+            try:
+                operation = await asyncio.wait_for(future, timeout)
+            finally:
+                self.pending.get((project_id, zone), {}).pop(name, None)
+        return check_operation(operation, verbose_name)
+
+    async def _run(self) -> None:
+        while any(self.pending.values()):
+            await asyncio.sleep(self.interval)
+            polls = []
+            for (project_id, zone), futures in self.pending.items():
+                names = list(futures)
+                for i in range(0, len(names), self.batch_size):
+                    polls.append(self._poll(project_id, zone, names[i:i + self.batch_size]))
+            await asyncio.gather(*polls)
+
+    async def _poll(self, project_id: str, zone: str, names: List[str]) -> None:
+        params = {"filter": f'name eq "({"|".join(re.escape(name) for name in names)})"', "maxResults": 500}
+        self.requests += 1
+        try:
+            page = await self.client.call("GET", f"/projects/{project_id}/zones/{zone}/operations", params=params)
+        except Exception as e:
+            # Network errors and bad bodies included: one failure here would end the loop for every waiter.
+            # Try again next round; the per-VM timeout still bounds how long anyone waits.
+            print(f"Polling operations in {zone} failed: {e}", file=sys.stderr, flush=True)
+            return
+        futures = self.pending.get((project_id, zone), {})
+        for operation in page.get("items", []):
+            future = futures.get(operation.get("name"))
+            if operation.get("status") == "DONE" and future and not future.done():
+                future.set_result(operation)
+                self.resolved += 1
+
+
+class ReadinessPoller:
+    # Watches the phase each VM's startup script publishes to guest attributes. Every round polls all VMs still
+    # booting at once, paced by the per-project read bucket, instead of each VM sleeping on its own schedule.
+
+    def __init__(self, client: AsyncComputeClient, interval: float = 10.0):
+        self.client = client
+        self.interval = interval
+        self.pending: Dict[Tuple[str, str, str], Tuple[asyncio.Future, float, Dict[str, Any]]] = {}
+        self.requests = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def wait(self, project_id: str, zone: str, vm_name: str, started: float, stats: Dict[str, Any],
+                   timeout: float = 1800) -> str:
+        key = (project_id, zone, vm_name)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = (future, started, stats)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(key, None)
+
+    async def _run(self) -> None:
+        while self.pending:
+            await asyncio.sleep(self.interval)
+            await asyncio.gather(*(self._poll(key) for key in list(self.pending)))
+
+    async def _poll(self, key: Tuple[str, str, str]) -> None:
+        project_id, zone, vm_name = key
+        self.requests += 1
+        try:
+            attributes = await self.client.guest_attributes(project_id, zone, vm_name, f"{READY_NAMESPACE}/")
+        except exceptions.NotFound:
+            # Nothing published yet.
+            return
+        except Exception as e:
+            # Try again next round, like OperationPoller.
+            print(f"Reading guest attributes of {vm_name} failed: {e}", file=sys.stderr, flush=True)
+            return
+        phase = attributes.get("phase")
+        if key not in self.pending or not phase:
+            return
+        future, started, stats = self.pending[key]
+        phases = stats.setdefault("phases", {})
+        if phase not in phases:
+            phases[phase] = round(time.monotonic() - started, 1)
+            print(f"Instance {vm_name}: {phase}.")
+        if phase in READY_PHASES and not future.done():
+            future.set_result(phase)
+
+
+async def create_instance_async(client: AsyncComputeClient, project_id: str, zone: str,
+                                instance: compute_v1.Instance, controller: AimdController,
+                                poller: OperationPoller = None, fetch_instance: bool = True,
+                                stats: Dict[str, Any] = None, source: Dict[str, str] = None,
+                                launch_id: str = None, generation: int = 0) -> compute_v1.Instance:
+    launch_id = launch_id or new_launch_id()
+    print(f"Creating the {instance.name} instance in {zone}...")
+    delays = backoff_delays()
+    for attempt in range(1, RETRY_ATTEMPTS + 1):
+        request_id = insert_request_id(launch_id, project_id, zone, instance.name, generation)
+        journal_event(instance.name, "inserting", project=project_id, zone=zone, request_id=request_id,
+                      generation=generation)
+        operation = await with_retries_async(
+            lambda: client.insert_instance(project_id, zone, instance, request_id, source), controller, stats)
+        journal_event(instance.name, "pending", operation=operation["name"])
+        try:
+            if poller:
+                await poller.wait(project_id, zone, operation, "instance creation")
+            else:
+                await with_retries_async(
+                    lambda: client.wait_operation(project_id, zone, operation, "instance creation"), controller, stats)
+            break
+        except Exception as e:
+            if classify_error(e) != "retryable" or attempt == RETRY_ATTEMPTS:
+                raise
+            # Resending the same ID picks a timed-out operation up again; a failed one needs a fresh ID.
+            if not is_timeout(e):
+                generation += 1
+            delay = next(delays)
+            record_backoff(stats, delay)
+            await asyncio.sleep(delay)
+    journal_event(instance.name, "done")
+    print(f"Instance {instance.name} created.")
+    if not fetch_instance:
+        instance.zone = f"projects/{project_id}/zones/{zone}"
+        return instance
+    return await with_retries_async(lambda: client.get_instance(project_id, zone, instance.name), controller, stats)
+
+
+async def wait_booted(client: AsyncComputeClient, project_id: str, zone: str, vm_name: str, started: float,
+                      stats: Dict[str, Any], controller: AimdController = None, timeout: float = 1800,
+                      interval: float = 10) -> None:
+    # Records when the VM reached RUNNING and when its startup scripts finished, both counted from the insert.
+    offset, tail = 0, ""
+    while "script_seconds" not in stats:
+        if time.monotonic() - started > timeout:
+            raise asyncio.TimeoutError(f"{vm_name} did not finish its startup scripts in {timeout} seconds")
+        if "running_seconds" not in stats:
+            instance = await with_retries_async(lambda: client.get_instance(project_id, zone, vm_name), controller)
+            if instance.status == "RUNNING":
+                stats["running_seconds"] = time.monotonic() - started
+                continue
+        else:
+            output = await with_retries_async(lambda: client.serial_output(project_id, zone, vm_name, offset),
+                                              controller)
+            offset = int(output.get("next", offset))
+            contents = tail + output.get("contents", "")
+            if STARTUP_DONE.search(contents):
+                stats["script_seconds"] = time.monotonic() - started
+                return
+            # Keep the end of this chunk in case the marker is split across two reads.
+            tail = contents[-64:]
+        await asyncio.sleep(interval)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {"count": len(values), "p50": round(values[len(values) // 2], 1),
+            "p90": round(values[min(len(values) - 1, int(len(values) * 0.9))], 1), "max": round(values[-1], 1)}
+
+
+def timing_report(boot_source: str, vm_stats: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    report = {}
+    for phase in ("insert", "running", "script", "ready"):
+        values = [stats[f"{phase}_seconds"] for stats in vm_stats.values() if f"{phase}_seconds" in stats]
+        if values:
+            report[phase] = percentiles(values)
+    print(f"Timing for boot source {boot_source} (seconds since each VM's first insert):")
+    for phase, summary in report.items():
+        print(f" - {phase}: {summary['count']} vms, p50 {summary['p50']}, p90 {summary['p90']}, "
+              f"max {summary['max']}")
+    return report
+
+
+async def fleet_snapshot_async(client: AsyncComputeClient, project_id: str,
+                               vm_names: List[str]) -> Dict[str, compute_v1.Instance]:
+    wanted = set(vm_names)
+    instances = await client.aggregated_list_instances(project_id, name_filter(vm_names))
+    return {instance.name: instance for instance in instances if instance.name in wanted}
+
+
+async def create_fleet(project_id: str, placement: ZonePlacement, vm_names: List[str], image_project: str,
+                       image_family: str, startup_script: str = None, max_in_flight: int = 32,
+                       controller: AimdController = None, get_each: bool = False,
+                       vm_stats: Dict[str, Dict[str, Any]] = None, labels: Dict[str, str] = None,
+                       use_template: bool = False, boot_source: str = "image", source_name: str = None,
+                       timing: bool = False, wait_ready: bool = False, ready_timeout: float = 1800,
+                       launch_id: str = None) -> Dict[str, Any]:
+    launch_id = launch_id or new_launch_id()
+    metadata = startup_metadata(startup_script)
+    vm_stats = vm_stats if vm_stats is not None else {}
+    controller = controller or AimdController(max_in_flight)
+    assigned = placement.assign(vm_names)
+    source = None
+    if boot_source == "machine-image":
+        # The machine image carries disks, network and metadata; inserts only name the VM, plus any startup script.
+        source = {"sourceMachineImage": global_resource(project_id, "machineImages", source_name)}
+    elif boot_source == "snapshot":
+        source_snapshot = global_resource(project_id, "snapshots", source_name)
+    else:
+        # Resolve the image family off the event loop; every VM then reuses the pinned image.
+        await asyncio.get_running_loop().run_in_executor(None, resolve_image, image_project, image_family)
+        if use_template and vm_names:
+            template = await asyncio.get_running_loop().run_in_executor(
+                None, ensure_template, project_id, placement.zones[0], image_project, image_family, startup_script)
+            source = {"sourceInstanceTemplate": template}
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=max_in_flight)) as session:
+        client = AsyncComputeClient(session)
+        poller = OperationPoller(client)
+        readiness = ReadinessPoller(client)
+
+        async def create_one(vm_name: str):
+            stats = vm_stats.setdefault(vm_name, new_vm_stats())
+            started = None
+            tried = set()
+            zone = placement.next_zone(assigned[vm_name], tried)
+            error = RuntimeError(f"No zone with capacity left for {vm_name}.")
+            result = None
+            while zone and result is None:
+                async with controller.slot():
+                    if source:
+                        # Only the per-VM fields go over the wire; the source has zone-independent types.
+                        instance = compute_v1.Instance()
+                        instance.name = vm_name
+                        if labels:
+                            instance.labels = labels
+                        if metadata and "sourceMachineImage" in source:
+                            # Overrides the machine image's metadata, so the script runs and reports readiness.
+                            instance.metadata = metadata
+                    else:
+                        # Disk type and machine type URLs are zonal, so the instance is rebuilt for every zone tried.
+                        disks = (snapshot_boot_disks(zone, source_snapshot) if boot_source == "snapshot"
+                                 else image_boot_disks(zone, image_project, image_family))
+                        instance = build_instance(zone, vm_name, disks, metadata=metadata, labels=labels)
+                    # Timings count from this VM's first insert, not from when it was queued for a slot.
+                    started = started or time.monotonic()
+                    try:
+                        result = await create_instance_async(client, project_id, zone, instance, controller,
+                                                             poller, get_each, stats, source, launch_id,
+                                                             placement.generations.get(vm_name, 0))
+                    except Exception as e:
+                        error = e
+                        if classify_error(e) != "stockout":
+                            break
+                        placement.mark_exhausted(zone)
+                        tried.add(zone)
+                        zone = placement.next_zone(assigned[vm_name], tried)
+                    else:
+                        controller.on_success()
+                        stats["insert_seconds"] = time.monotonic() - started
+            if result is None:
+                print(f"Instance {vm_name} failed: {error}", file=sys.stderr, flush=True)
+                journal_event(vm_name, "failed", error=str(error))
+                emit_vm(vm_name, error, stats)
+                return error
+            if timing:
+                try:
+                    await wait_booted(client, project_id, zone, vm_name, started, stats, controller)
+                except Exception as e:
+                    print(f"Timing {vm_name} failed: {e}", file=sys.stderr, flush=True)
+            if wait_ready:
+                # Without a startup script of ours there is nothing to wait for beyond the insert. Every boot source
+                # sends the script when there is one: in the body, as a machine image override or in the template.
+                try:
+                    phase = (await readiness.wait(project_id, zone, vm_name, started, stats, ready_timeout)
+                             if metadata else "service-up")
+                except asyncio.TimeoutError:
+                    error = asyncio.TimeoutError(f"{vm_name} was not ready after {ready_timeout} seconds.")
+                    print(f"Instance {vm_name} failed: {error}", file=sys.stderr, flush=True)
+                    emit_vm(vm_name, error, stats)
+                    return error
+                if phase == "failed":
+                    error = RuntimeError(f"The startup script on {vm_name} failed.")
+                    print(f"Instance {vm_name} failed: {error}", file=sys.stderr, flush=True)
+                    emit_vm(vm_name, error, stats)
+                    return error
+                stats["ready_seconds"] = time.monotonic() - started
+                stats["ready_at"] = time.time()
+            if _output is not None:
+                # Streamed the moment the VM runs (or is ready), IPs included, so callers can start using it.
+                if not get_each:
+                    result = await with_retries_async(lambda: client.get_instance(project_id, zone, vm_name),
+                                                      controller)
+                while result.status in ("PROVISIONING", "STAGING"):
+                    await asyncio.sleep(2)
+                    result = await with_retries_async(lambda: client.get_instance(project_id, zone, vm_name),
+                                                      controller)
+                emit_vm(vm_name, result, stats)
+            return result
+
+        results = dict(zip(vm_names, await asyncio.gather(*(create_one(vm_name) for vm_name in vm_names))))
+        if not get_each:
+            created = [vm_name for vm_name, result in results.items() if not isinstance(result, Exception)]
+            if created:
+                snapshot = await fleet_snapshot_async(client, project_id, created)
+                for vm_name in created:
+                    # A VM the list did not return yet falls back to its own get.
+                    results[vm_name] = snapshot.get(vm_name) or await client.get_instance(
+                        project_id, results[vm_name].zone.rsplit("/", 1)[-1], vm_name)
+
+    metrics = controller.metrics()
+    print(f"Concurrency window: {metrics['window']} (lowest {metrics['lowest_window']}), "
+          f"rate limited {metrics['rate_limited']} times.")
+    print(f"Operation polling: {poller.requests} list requests resolved {poller.resolved} operations.")
+    if wait_ready:
+        print(f"Readiness polling: {readiness.requests} guest attribute reads.")
+    return results
+
+
+async def instance_action_async(client: AsyncComputeClient, project_id: str, zone: str, instance_name: str,
+                                action: str, controller: AimdController, poller: OperationPoller,
+                                stats: Dict[str, Any] = None) -> None:
+    doing, done = LIFECYCLE_ACTIONS[action]
+    print(f"{doing} the {instance_name} instance in {zone}...")
+    # One ID per action, kept across retries: the same VM may be stopped and started again in one run.
+    request_id = str(uuid.uuid4())
+    try:
+        operation = await with_retries_async(
+            lambda: client.instance_action(project_id, zone, instance_name, action, request_id), controller, stats)
+        await poller.wait(project_id, zone, operation, f"instance {action}")
+    except exceptions.NotFound:
+        if action != "delete":
+            raise
+        # Already gone, which is all we wanted.
+    print(f"Instance {instance_name} {done}.")
+
+
+async def fleet_action(project_id: str, instances: List[compute_v1.Instance], action: str, max_in_flight: int = 32,
+                       controller: AimdController = None,
+                       vm_stats: Dict[str, Dict[str, Any]] = None) -> Dict[str, Any]:
+    vm_stats = vm_stats if vm_stats is not None else {}
+    controller = controller or AimdController(max_in_flight)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=max_in_flight)) as session:
+        client = AsyncComputeClient(session)
+        poller = OperationPoller(client)
+
+        async def act_on(instance: compute_v1.Instance):
+            stats = vm_stats.setdefault(instance.name, new_vm_stats())
+            async with controller.slot():
+                try:
+                    await instance_action_async(client, project_id, instance.zone.rsplit("/", 1)[-1], instance.name,
+                                                action, controller, poller, stats)
+                except Exception as e:
+                    print(f"{LIFECYCLE_ACTIONS[action][0]} {instance.name} failed: {e}", file=sys.stderr, flush=True)
+                    return e
+            controller.on_success()
+            return instance
+
+        results = await asyncio.gather(*(act_on(instance) for instance in instances))
+
+    print(f"Operation polling: {poller.requests} list requests resolved {poller.resolved} operations.")
+    return {instance.name: result for instance, result in zip(instances, results)}
+
+
+def parse_labels(labels: str) -> Dict[str, str]:
+    # "env=test,team=ml" -> {"env": "test", "team": "ml"}
+    pairs = (item.strip().partition("=") for item in labels.split(","))
+    return {key: value for key, _, value in pairs if key}
+
+
+def selection_filter(name_prefix: str = None, labels: Dict[str, str] = None) -> Optional[str]:
+    # aggregatedList takes either one regex comparison or ANDed equality expressions, so labels are only sent
+    # when there is no name to match; select_instances applies both either way.
+    if name_prefix:
+        return f'name eq "{re.escape(name_prefix)}\\d+"'
+    if labels:
+        return " ".join(f'(labels.{key} = "{value}")' for key, value in labels.items())
+    return None
+
+
+def select_instances(instances: List[compute_v1.Instance], name_prefix: str = None, start: int = None,
+                     end: int = None, labels: Dict[str, str] = None) -> List[compute_v1.Instance]:
+    pattern = re.compile(rf"{re.escape(name_prefix)}(\d+)") if name_prefix else None
+    selected = []
+    for instance in instances:
+        if pattern:
+            match = pattern.fullmatch(instance.name)
+            if not match:
+                continue
+            number = int(match.group(1))
+            if (start is not None and number < start) or (end is not None and number > end):
+                continue
+        if labels and any(instance.labels.get(key) != value for key, value in labels.items()):
+            continue
+        selected.append(instance)
+    return selected
+
+
+async def list_fleet(project_id: str, name_prefix: str = None, start: int = None, end: int = None,
+                     labels: Dict[str, str] = None) -> List[compute_v1.Instance]:
+    async with aiohttp.ClientSession() as session:
+        instances = await AsyncComputeClient(session).aggregated_list_instances(
+            project_id, selection_filter(name_prefix, labels))
+    return select_instances(instances, name_prefix, start, end, labels)
 
 
-def create_vm(project_id, zone, vm_name, image_project, image_family, startup_script):
-    thread = threading.Thread(target=create_from_image,
-                              args=(project_id, zone, vm_name, image_project, image_family, startup_script))
-    thread.start()
-    return thread
+async def reconcile_fleet(project_id: str, name_prefix: str, count: int, placement: ZonePlacement,
+                          image_project: str, image_family: str, startup_script: str = None,
+                          max_in_flight: int = 32, yes: bool = False) -> Dict[str, Dict[str, Any]]:
+    # One aggregatedList, then only the difference: the missing names are created, the surplus deleted.
+    existing = {instance.name: instance for instance in await list_fleet(project_id, name_prefix)}
+    desired = [f"{name_prefix}{i}" for i in range(1, count + 1)]
+    missing = [vm_name for vm_name in desired if vm_name not in existing]
+    surplus = [instance for vm_name, instance in existing.items() if vm_name not in set(desired)]
+    print(f"{len(existing)} existing, {count} desired: creating {len(missing)}, deleting {len(surplus)}.")
+    # Like delete: a mistyped --count must not tear the fleet down unasked.
+    if surplus and not yes:
+        print("Surplus instances: " + ", ".join(instance.name for instance in surplus))
+        if input(f"Delete {len(surplus)} instances? [y/N] ").strip().lower() != 'y':
+            print("Keeping the surplus instances.")
+            surplus = []
+
+    # Creates and deletes share one window, so together they stay within max_in_flight.
+    controller = AimdController(max_in_flight)
+    with pinned_images():
+        created, deleted = await asyncio.gather(
+            create_fleet(project_id, placement, missing, image_project, image_family, startup_script, max_in_flight,
+                         controller) if missing else asyncio.sleep(0, {}),
+            fleet_action(project_id, surplus, "delete", max_in_flight, controller) if surplus else asyncio.sleep(0, {}))
+    return {"created": created, "deleted": deleted}
+
+
+def reconcile(project_id: str, name_prefix: str, count: int, zones: List[str], placement: str = "spread",
+              zone_weights: Dict[str, float] = None, image_project: str = "debian-cloud",
+              image_family: str = "debian-11", startup_script: str = None,
+              max_in_flight: int = 32, yes: bool = False) -> Dict[str, Dict[str, Any]]:
+    results = asyncio.run(reconcile_fleet(project_id, name_prefix, count, ZonePlacement(zones, placement, zone_weights),
+                                          image_project, image_family, startup_script, max_in_flight, yes))
+    for action, outcome in results.items():
+        failed = sum(1 for result in outcome.values() if isinstance(result, Exception))
+        print(f"{len(outcome) - failed} {action}, {failed} failed.")
+    return results
+
+
+def list_vms(projects: List[str], name_prefix: str = None, start: int = None, end: int = None,
+             labels: Dict[str, str] = None) -> Dict[str, List[compute_v1.Instance]]:
+    async def list_all():
+        return await asyncio.gather(*(list_fleet(project_id, name_prefix, start, end, labels)
+                                      for project_id in projects))
+
+    return dict(zip(projects, asyncio.run(list_all())))
+
+
+def reclaimed_resources(project_id: str, instances: List[compute_v1.Instance]) -> Dict[str, int]:
+    vcpus = sum(machine_cpus(project_id, instance.zone.rsplit("/", 1)[-1], instance.machine_type.rsplit("/", 1)[-1])
+                for instance in instances)
+    disks = [disk for instance in instances for disk in instance.disks]
+    # Disks attached without auto-delete outlive their VM and keep costing money.
+    deleted = [disk for disk in disks if disk.auto_delete]
+    return {"instances": len(instances), "vcpus": vcpus, "disks": len(deleted),
+            "disk_gb": sum(disk.disk_size_gb for disk in deleted), "kept_disks": len(disks) - len(deleted)}
+
+
+def change_vms(selection: Dict[str, List[compute_v1.Instance]], action: str,
+               max_in_flight: int = 32) -> Dict[str, Any]:
+    # GCE has no bulk lifecycle calls, so every VM gets its own on the async engine, all projects on one loop.
+    statuses = ACTION_STATUSES.get(action)
+    if statuses:
+        skipped = [instance.name for instances in selection.values() for instance in instances
+                   if instance.status not in statuses]
+        if skipped:
+            print(f"Skipping {len(skipped)} instances that cannot be {LIFECYCLE_ACTIONS[action][1]} from their "
+                  f"current status: {', '.join(skipped)}")
+        selection = {project_id: [instance for instance in instances if instance.status in statuses]
+                     for project_id, instances in selection.items()}
+
+    async def act_on_all():
+        return await asyncio.gather(*(fleet_action(project_id, instances, action, max_in_flight)
+                                      for project_id, instances in selection.items() if instances))
+
+    results = {}
+    for outcome in asyncio.run(act_on_all()):
+        results.update(outcome)
+    failed = sum(1 for result in results.values() if isinstance(result, Exception))
+    print(f"{len(results) - failed} {LIFECYCLE_ACTIONS[action][1]}, {failed} failed.")
+    return results
+
+
+def delete_vms(selection: Dict[str, List[compute_v1.Instance]], max_in_flight: int = 32) -> Dict[str, Any]:
+    results = change_vms(selection, "delete", max_in_flight)
+    totals = {}
+    for project_id, instances in selection.items():
+        deleted = [instance for instance in instances if not isinstance(results.get(instance.name), Exception)]
+        if not deleted:
+            continue
+        for key, value in reclaimed_resources(project_id, deleted).items():
+            totals[key] = totals.get(key, 0) + value
+        # One more list confirms nothing was left behind.
+        for vm_name in fleet_snapshot(project_id, [instance.name for instance in deleted]):
+            results[vm_name] = RuntimeError(f"{vm_name} still exists after its delete finished.")
+    if totals:
+        print(f"Reclaimed {totals['vcpus']} vCPUs and {totals['disks']} disks ({totals['disk_gb']} GB).")
+        if totals["kept_disks"]:
+            print(f"{totals['kept_disks']} disks were not set to auto-delete and still exist.")
+    for vm_name, result in results.items():
+        if isinstance(result, Exception):
+            print(f" - {vm_name}: {result}", file=sys.stderr, flush=True)
+    return results
+
+
+def restart_vms(selection: Dict[str, List[compute_v1.Instance]], max_in_flight: int = 32,
+                settle_timeout: float = 300) -> Dict[str, Any]:
+    # Stopped and suspended VMs with the requested names are started or resumed instead of created again:
+    # their disks and installed packages are still there.
+    selection = {project_id: list(instances) for project_id, instances in selection.items()}
+    # A VM caught stopping or suspending (a spot VM mid-preemption, say) is waited for first, then started or resumed.
+    deadline = time.monotonic() + settle_timeout
+    while time.monotonic() < deadline:
+        settling = {project_id: [instance.name for instance in instances if instance.status in SETTLING_STATUSES]
+                    for project_id, instances in selection.items()}
+        if not any(settling.values()):
+            break
+        time.sleep(5)
+        for project_id, vm_names in settling.items():
+            if vm_names:
+                snapshot = fleet_snapshot(project_id, vm_names)
+                selection[project_id] = [snapshot.get(instance.name, instance) for instance in selection[project_id]]
+    results = {}
+    for action in ("start", "resume"):
+        found = {project_id: [instance for instance in instances if instance.status in ACTION_STATUSES[action]]
+                 for project_id, instances in selection.items()}
+        if any(found.values()):
+            results.update(change_vms(found, action, max_in_flight))
+    for project_id, instances in selection.items():
+        restarted = [instance.name for instance in instances if not isinstance(results.get(instance.name), Exception)]
+        snapshot = fleet_snapshot(project_id, restarted) if restarted else {}
+        for vm_name in restarted:
+            instance = snapshot.get(vm_name)
+            if instance is None:
+                results[vm_name] = RuntimeError(f"{vm_name} disappeared while restarting.")
+            elif instance.status not in ACTION_STATUSES["stop"]:
+                # Still settling after the timeout, or in a state like REPAIRING: it is neither running nor created.
+                results[vm_name] = RuntimeError(f"{vm_name} is {instance.status} and could not be restarted.")
+            else:
+                results[vm_name] = instance
+                journal_event(vm_name, "done", project=project_id, zone=instance.zone.rsplit("/", 1)[-1])
+                continue
+            journal_event(vm_name, "failed", error=str(results[vm_name]))
+    return results
+
+
+class WarmPool:
+    # Keeps `size` booted-then-parked VMs per zone, labelled warm-pool=<name>, and hands them out on acquire.
+    # Stopping an acquired VM puts it back in the pool.
+
+    def __init__(self, project_id: str, name: str, zones: List[str], size: int, image_project: str,
+                 image_family: str, startup_script: str = None, park: str = "stop", boot_seconds: float = 1800,
+                 max_in_flight: int = 32):
+        self.project_id = project_id
+        self.name = name
+        self.zones = zones
+        self.size = size
+        self.image_project = image_project
+        self.image_family = image_family
+        self.startup_script = startup_script
+        self.park = park
+        self.boot_seconds = boot_seconds
+        self.max_in_flight = max_in_flight
+        self.labels = {"warm-pool": name}
+        self.hits = 0
+        self.misses = 0
+        self.latencies: List[float] = []
+        # VMs booting before they are parked, and VMs picked by an acquire that is still starting them.
+        self._filling: Dict[str, str] = {}
+        self._taken = set()
+        self._refill_task: Optional[asyncio.Task] = None
+
+    def _new_names(self, count: int) -> List[str]:
+        return [f"{self.name}-{uuid.uuid4().hex[:8]}" for _ in range(count)]
+
+    def _parked(self, members: List[compute_v1.Instance]) -> List[compute_v1.Instance]:
+        parked = ACTION_STATUSES["start"] | ACTION_STATUSES["resume"]
+        busy = self._taken | set(self._filling)
+        return [instance for instance in members if instance.status in parked and instance.name not in busy]
+
+    async def refill(self) -> None:
+        while True:
+            parked = self._parked(await list_fleet(self.project_id, labels=self.labels))
+            deficits = {}
+            for zone in self.zones:
+                have = sum(1 for instance in parked if instance.zone.endswith(f"/{zone}"))
+                have += sum(1 for filling_zone in self._filling.values() if filling_zone == zone)
+                if have < self.size:
+                    deficits[zone] = self.size - have
+            if not deficits:
+                return
+            if not await self._fill(deficits):
+                print(f"Warm pool {self.name} could not boot any instance, giving up on this refill.",
+                      file=sys.stderr, flush=True)
+                return
+
+    async def _fill(self, deficits: Dict[str, int]) -> int:
+        names = {zone: self._new_names(count) for zone, count in deficits.items()}
+        for zone, zone_names in names.items():
+            self._filling.update(dict.fromkeys(zone_names, zone))
+        try:
+            with pinned_images():
+                outcomes = await asyncio.gather(*(
+                    # Parked once the startup script is done, so a VM handed out later is ready as soon as it boots.
+                    create_fleet(self.project_id, ZonePlacement([zone]), zone_names, self.image_project,
+                                 self.image_family, self.startup_script, self.max_in_flight, labels=self.labels,
+                                 wait_ready=True, ready_timeout=self.boot_seconds)
+                    for zone, zone_names in names.items()))
+            booted = [instance for outcome in outcomes for instance in outcome.values()
+                      if not isinstance(instance, Exception)]
+            failed = [vm_name for outcome in outcomes for vm_name, result in outcome.items()
+                      if isinstance(result, Exception)]
+            if failed:
+                # A VM that was not ready in time or whose script failed keeps running and billing, and carries the
+                # pool label: once stopped it would join the pool with a broken install.
+                async with aiohttp.ClientSession() as session:
+                    leftovers = await fleet_snapshot_async(AsyncComputeClient(session), self.project_id, failed)
+                if leftovers:
+                    print(f"Deleting {len(leftovers)} warm pool instances that did not get ready.",
+                          file=sys.stderr, flush=True)
+                    await fleet_action(self.project_id, list(leftovers.values()), "delete", self.max_in_flight)
+            if booted:
+                await fleet_action(self.project_id, booted, self.park, self.max_in_flight)
+            return len(booted)
+        finally:
+            for zone_names in names.values():
+                for vm_name in zone_names:
+                    self._filling.pop(vm_name, None)
+
+    async def acquire(self, count: int) -> List[compute_v1.Instance]:
+        started = time.monotonic()
+        pooled = self._parked(await list_fleet(self.project_id, labels=self.labels))[:count]
+        self._taken.update(instance.name for instance in pooled)
+        try:
+            woken = await asyncio.gather(*(
+                fleet_action(self.project_id, instances, action, self.max_in_flight)
+                for action, instances in (
+                    ("start", [instance for instance in pooled if instance.status in ACTION_STATUSES["start"]]),
+                    ("resume", [instance for instance in pooled if instance.status in ACTION_STATUSES["resume"]]))
+                if instances))
+            hits = [vm_name for outcome in woken for vm_name, result in outcome.items()
+                    if not isinstance(result, Exception)]
+            # Whatever the pool could not cover is created from scratch, with the pool label so it can be parked later.
+            fresh = self._new_names(count - len(hits))
+            with pinned_images():
+                created = await create_fleet(self.project_id, ZonePlacement(self.zones), fresh, self.image_project,
+                                             self.image_family, self.startup_script, self.max_in_flight,
+                                             labels=self.labels) if fresh else {}
+            async with aiohttp.ClientSession() as session:
+                # Started VMs get a new ephemeral external IP; read them back in one list.
+                snapshot = await fleet_snapshot_async(AsyncComputeClient(session), self.project_id,
+                                                      hits) if hits else {}
+        finally:
+            self._taken.difference_update(instance.name for instance in pooled)
+
+        acquired = list(snapshot.values()) + [result for result in created.values()
+                                              if not isinstance(result, Exception)]
+        latency = time.monotonic() - started
+        self.hits += len(hits)
+        self.misses += count - len(hits)
+        self.latencies.append(latency)
+        print(f"Acquired {len(acquired)} of {count} instances in {latency:.1f}s: {len(hits)} from the warm pool, "
+              f"{len(acquired) - len(snapshot)} created.")
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self.refill())
+        return acquired
+
+    async def wait_refilled(self) -> None:
+        if self._refill_task:
+            await self._refill_task
+
+    def metrics(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        requested = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / requested, 3) if requested else None,
+                "latency_p50": round(latencies[len(latencies) // 2], 1) if latencies else None,
+                "latency_max": round(latencies[-1], 1) if latencies else None}
+
+
+async def acquire_from_pool(pool: WarmPool, count: int) -> List[compute_v1.Instance]:
+    # CLI entry point: hand the VMs out first, then stay up until the pool is topped up again.
+    acquired = await pool.acquire(count)
+    for instance in acquired:
+        interface = instance.network_interfaces[0]
+        external = interface.access_configs[0].nat_i_p if interface.access_configs else ""
+        print(f" - {instance.name} {instance.zone.rsplit('/', 1)[-1]} {interface.network_i_p} {external}")
+    metrics = pool.metrics()
+    print(f"Warm pool hit rate {metrics['hit_rate']}, acquisition latency {metrics['latency_p50']}s.")
+    await pool.wait_refilled()
+    return acquired
+
+
+def instance_host(instance: compute_v1.Instance, internal_ip: bool = False) -> Optional[str]:
+    interface = instance.network_interfaces[0] if instance.network_interfaces else None
+    if interface is None:
+        return None
+    if internal_ip:
+        return interface.network_i_p or None
+    return (interface.access_configs[0].nat_i_p or None) if interface.access_configs else None
+
+
+class SshPool:
+    # One paramiko connection per host, opened on first use and reused by every later command on that host.
+
+    def __init__(self, username: str = None, key_filename: str = None, max_in_flight: int = 32,
+                 connect_timeout: float = 15):
+        self.username = username or getpass.getuser()
+        # The key gcloud compute ssh installs on the fleet; otherwise paramiko tries the agent and ~/.ssh keys.
+        default_key = os.path.expanduser("~/.ssh/google_compute_engine")
+        self.key_filename = key_filename or (default_key if os.path.exists(default_key) else None)
+        self.max_in_flight = max_in_flight
+        self.connect_timeout = connect_timeout
+        self.opened = 0
+        self.reused = 0
+        self._clients: Dict[str, paramiko.SSHClient] = {}
+        self._lock = threading.Lock()
+        self._print_lock = threading.Lock()
+
+    def _client(self, host: str) -> paramiko.SSHClient:
+        with self._lock:
+            client = self._clients.get(host)
+            transport = client.get_transport() if client else None
+            if transport is not None and transport.is_active():
+                self.reused += 1
+                return client
+        client = paramiko.SSHClient()
+        # Fleet VMs are new hosts with fresh host keys, so there is nothing to check them against yet.
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(host, username=self.username, key_filename=self.key_filename, timeout=self.connect_timeout,
+                       banner_timeout=self.connect_timeout, auth_timeout=self.connect_timeout)
+        client.get_transport().set_keepalive(30)
+        with self._lock:
+            self.opened += 1
+            self._clients[host] = client
+        return client
+
+    def _drop(self, host: str) -> None:
+        with self._lock:
+            client = self._clients.pop(host, None)
+        if client is not None:
+            client.close()
+
+    def run(self, vm_name: str, host: str, command: str, timeout: float = 300,
+            stream: bool = True) -> Dict[str, Any]:
+        result = {"name": vm_name, "host": host, "exit_code": None, "output": "", "error": None}
+        started = time.monotonic()
+        try:
+            channel = self._client(host).get_transport().open_session()
+            # stderr is merged the way an interactive ssh shows it, and a single stream cannot stall on the other.
+            # Both are set before the command starts, so none of its early stderr goes to a separate buffer.
+            channel.set_combined_stderr(True)
+            channel.settimeout(timeout)
+            channel.exec_command(command)
+            lines = []
+            with closing(channel):
+                for line in channel.makefile("r"):
+                    lines.append(line)
+                    if stream:
+                        with self._print_lock:
+                            print(f"{vm_name}: {line.rstrip()}", flush=True)
+                result["exit_code"] = channel.recv_exit_status()
+            result["output"] = "".join(lines)
+        except Exception as e:
+            # A broken or timed out connection is not reused; the next command opens a new one.
+            self._drop(host)
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["seconds"] = round(time.monotonic() - started, 3)
+        return result
+
+    def run_all(self, hosts: Dict[str, str], command: str, timeout: float = 300,
+                stream: bool = True) -> Dict[str, Dict[str, Any]]:
+        # hosts maps VM names to addresses; at most max_in_flight commands run at once.
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="ssh") as executor:
+            futures = {executor.submit(self.run, vm_name, host, command, timeout, stream): vm_name
+                       for vm_name, host in hosts.items()}
+            for future in as_completed(futures):
+                result = future.result()
+                results[result["name"]] = result
+                with self._print_lock:
+                    print(f"[{result['name']}] " + (f"exit {result['exit_code']}" if result["error"] is None
+                                                    else result["error"]) + f" in {result['seconds']:.1f}s",
+                          flush=True)
+                if _output is not None:
+                    _output.write({"type": "exec", **result})
+        return {vm_name: results[vm_name] for vm_name in hosts}
+
+    def close(self) -> None:
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.close()
+
+
+def exec_report(results: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    # Hosts that printed the same thing and exited the same way are shown once, largest group first.
+    groups = {}
+    for vm_name, result in results.items():
+        groups.setdefault((result["exit_code"], result["output"], result["error"]), []).append(vm_name)
+    report = {"hosts": len(results),
+              "succeeded": sum(1 for result in results.values() if result["exit_code"] == 0),
+              "groups": [{"exit_code": exit_code, "output": output, "error": error, "hosts": vm_names}
+                         for (exit_code, output, error), vm_names in
+                         sorted(groups.items(), key=lambda item: -len(item[1]))],
+              "latency": percentiles([result["seconds"] for result in results.values()]) if results else None}
+    report["failed"] = report["hosts"] - report["succeeded"]
+    for group in report["groups"]:
+        names = group["hosts"]
+        shown = ", ".join(names[:10]) + (f" and {len(names) - 10} more" if len(names) > 10 else "")
+        status = f"exit {group['exit_code']}" if group["error"] is None else group["error"]
+        print(f"{len(names)} hosts, {status}: {shown}")
+        for line in group["output"].splitlines():
+            print(f"    {line}")
+    if report["latency"]:
+        latency = report["latency"]
+        print(f"{report['succeeded']} succeeded, {report['failed']} failed. Latency p50 {latency['p50']}s, "
+              f"p90 {latency['p90']}s, max {latency['max']}s.")
+    return report
+
+
+def exec_vms(selection: Dict[str, List[compute_v1.Instance]], command: str, username: str = None,
+             key_filename: str = None, max_in_flight: int = 32, timeout: float = 300, internal_ip: bool = False,
+             stream: bool = True, pool: SshPool = None, output: str = "text") -> Dict[str, Dict[str, Any]]:
+    # Pass a pool to keep its connections open across several commands; one made here is closed at the end.
+    global _output
+    _output = NdjsonOutput(sys.stdout) if output == "ndjson" else None
+    owned = pool is None
+    pool = pool or SshPool(username, key_filename, max_in_flight)
+    try:
+        with redirect_stdout(sys.stderr) if _output else nullcontext():
+            hosts, results = {}, {}
+            for instances in selection.values():
+                for instance in instances:
+                    host = instance_host(instance, internal_ip)
+                    if host:
+                        hosts[instance.name] = host
+                    else:
+                        results[instance.name] = {
+                            "name": instance.name, "host": None, "exit_code": None, "output": "", "seconds": 0.0,
+                            "error": f"no {'internal' if internal_ip else 'external'} IP ({instance.status})"}
+            opened, reused = pool.opened, pool.reused
+            results.update(pool.run_all(hosts, command, timeout, stream))
+            print(f"SSH connections opened: {pool.opened - opened}, reused: {pool.reused - reused}")
+            report = exec_report(results)
+            if _output is not None:
+                _output.write({"type": "summary", **report})
+            return results
+    finally:
+        if owned:
+            pool.close()
+        _output = None
+
+
+def create_vm(project_id, zone, vm_name, image_project, image_family, startup_script,
+              executor: ThreadPoolExecutor, placement: ZonePlacement = None, fetch_instance: bool = True,
+              stats: Dict[str, Any] = None, launch_id: str = None) -> Future:
+    if placement:
+        return executor.submit(create_from_image_failover, project_id, placement, zone, vm_name, image_project,
+                               image_family, startup_script, fetch_instance, stats, launch_id)
+    return executor.submit(create_from_image, project_id, zone, vm_name, image_project, image_family, startup_script,
+                           fetch_instance, stats, launch_id)
+
+
+def collect_results(futures: Dict[Future, str]) -> Dict[str, Any]:
+    # Each future resolves to the compute_v1.Instance, or holds the exception that stopped that VM.
+    results = {}
+    for future in as_completed(futures):
+        vm_name = futures[future]
+        try:
+            results[vm_name] = future.result()
+        except Exception as e:
+            print(f"Instance {vm_name} failed: {e}", file=sys.stderr, flush=True)
+            journal_event(vm_name, "failed", error=str(e))
+            results[vm_name] = e
+    return {vm_name: results[vm_name] for vm_name in futures.values()}
+
+
+def create_vms_threaded(project_id: str, placement: ZonePlacement, vm_names: List[str], image_project: str,
+                        image_family: str, startup_script: str = None, max_in_flight: int = 32,
+                        get_each: bool = False, vm_stats: Dict[str, Dict[str, Any]] = None,
+                        launch_id: str = None) -> Dict[str, Any]:
+    configure_client_pool(max_in_flight)
+    launch_id = launch_id or new_launch_id()
+    vm_stats = vm_stats if vm_stats is not None else {}
+    assigned = placement.assign(vm_names)
+
+    # A fixed pool drains the work queue, so threads stay at max_in_flight whatever the fleet size.
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="create-vm") as executor:
+        futures = {}
+        for vm_name in vm_names:
+            future = create_vm(project_id, assigned[vm_name], vm_name, image_project, image_family, startup_script,
+                               executor, placement, get_each, vm_stats.setdefault(vm_name, new_vm_stats()),
+                               launch_id)
+            futures[future] = vm_name
+        results = collect_results(futures)
+
+    if not get_each:
+        created = [vm_name for vm_name, result in results.items() if not isinstance(result, Exception)]
+        if created:
+            snapshot = fleet_snapshot(project_id, created)
+            instance_client = get_client(compute_v1.InstancesClient, project_id)
+            for vm_name in created:
+                # A VM the list did not return yet falls back to its own get.
+                results[vm_name] = snapshot.get(vm_name) or instance_client.get(
+                    project=project_id, zone=results[vm_name].zone.rsplit("/", 1)[-1], instance=vm_name)
+
+    stats = client_pool_stats()
+    print(f"HTTP requests: {stats['requests']}, connections opened: {stats['connections_opened']}, "
+          f"reused: {stats['connections_reused']}")
+    return results
+
+
+def region_of(zone: str) -> str:
+    return zone.rsplit("-", 1)[0]
+
+
+def read_region_quotas(project_id: str, regions: List[str]) -> Dict[str, Dict[str, compute_v1.Quota]]:
+    # One regions.get per region returns every regional quota with its current usage.
+    client = get_client(compute_v1.RegionsClient, project_id)
+    quotas = {}
+    for region in regions:
+        rate_limiter(project_id, "read").acquire()
+        quotas[region] = {quota.metric: quota for quota in client.get(project=project_id, region=region).quotas}
+    return quotas
+
+
+def machine_cpus(project_id: str, zone: str, machine_type: str) -> int:
+    with _catalog_lock, closing(_catalog()) as db:
+        row = db.execute("SELECT guest_cpus FROM machine_types WHERE project = ? AND zone = ? AND name = ?",
+                         (project_id, zone, machine_type)).fetchone()
+    if row:
+        return row[0]
+    match = re.search(r"-(\d+)$", machine_type)
+    return int(match.group(1)) if match else 1
+
+
+def vm_quota_needs(project_id: str, zone: str, quotas: Dict[str, compute_v1.Quota],
+                   machine_type: str = DEFAULT_MACHINE_TYPE, spot: bool = True) -> Dict[str, int]:
+    cpus = machine_cpus(project_id, zone, machine_type)
+    needs = {"INSTANCES": 1, "CPUS": cpus, f"{machine_type.split('-')[0].upper()}_CPUS": cpus,
+             "IN_USE_ADDRESSES": 1, "DISKS_TOTAL_GB": DEFAULT_DISK_SIZE_GB}
+    # Spot VMs draw on the preemptible CPU quota when the project has one, and on CPUS otherwise.
+    if spot and "PREEMPTIBLE_CPUS" in quotas and quotas["PREEMPTIBLE_CPUS"].limit > 0:
+        needs["PREEMPTIBLE_CPUS"] = needs.pop("CPUS")
+    return needs
+
+
+def zone_capacity(project_id: str, zones: List[str]) -> Dict[str, int]:
+    # How many more VMs each zone can take before some regional quota runs out.
+    regions = sorted({region_of(zone) for zone in zones})
+    capacity = {}
+    for region, quotas in read_region_quotas(project_id, regions).items():
+        region_zones = [zone for zone in zones if region_of(zone) == region]
+        needs = vm_quota_needs(project_id, region_zones[0], quotas)
+        fits = {metric: int((quotas[metric].limit - quotas[metric].usage) // need)
+                for metric, need in needs.items() if metric in quotas}
+        if fits:
+            limiting = min(fits, key=fits.get)
+            room = max(fits[limiting], 0)
+            print(f"Project {project_id} {region}: room for {room} instances (limited by {limiting}).")
+        else:
+            room = sys.maxsize
+        share, extra = divmod(room, len(region_zones))
+        for i, zone in enumerate(region_zones):
+            capacity[zone] = share + (1 if i < extra else 0)
+    return capacity
+
+
+def plan_launch(project_id: str, vm_names: List[str], zones: List[str], capacity: Optional[Dict[str, int]],
+                quota_policy: str, placement: str, zone_weights: Dict[str, float]) -> Tuple[List[str], ZonePlacement]:
+    zone_placement = ZonePlacement(zones, placement, zone_weights)
+    if capacity is None:
+        return vm_names, zone_placement
+    room = sum(capacity.values())
+    if len(vm_names) > room and quota_policy == "refuse":
+        raise RuntimeError(f"Project {project_id} has quota for {room} more instances in {', '.join(zones)}, "
+                           f"but {len(vm_names)} were requested. Use --quota-policy trim or split, "
+                           f"or add --zones / --projects.")
+    if quota_policy == "split":
+        # Weight the zones by what their regions can still hold, and drop the ones that are full.
+        usable = [zone for zone in zones if capacity[zone] > 0]
+        zone_placement = ZonePlacement(usable or zones, "weighted", {zone: capacity[zone] for zone in usable})
+    if len(vm_names) > room:
+        print(f"Trimming {project_id} to {room} of {len(vm_names)} instances to stay within quota.",
+              file=sys.stderr, flush=True)
+    return vm_names[:room], zone_placement
+
+
+def split_counts(total: int, capacities: Dict[str, int]) -> Dict[str, int]:
+    # Largest remainder split of total in proportion to capacities, never past a capacity.
+    room = sum(capacities.values())
+    target = min(total, room)
+    if not target:
+        return {key: 0 for key in capacities}
+    shares = {key: target * capacity / room for key, capacity in capacities.items()}
+    counts = {key: int(share) for key, share in shares.items()}
+    remainders = sorted(shares, key=lambda key: shares[key] - counts[key], reverse=True)
+    for key in remainders[:target - sum(counts.values())]:
+        counts[key] += 1
+    return counts
+
+
+def shard_vm_names(vm_names: List[str], projects: List[str], sharding: str = "quota",
+                   capacities: Dict[str, Dict[str, int]] = None) -> Dict[str, List[str]]:
+    capacities = capacities or {}
+    if sharding == "quota":
+        capacities = {project_id: sum(capacities[project_id].values()) if project_id in capacities else sys.maxsize
+                      for project_id in projects}
+    else:
+        capacities = {project_id: len(vm_names) for project_id in projects}
+    counts = split_counts(len(vm_names), capacities)
+
+    shards, offset = {}, 0
+    for project_id in projects:
+        shards[project_id] = vm_names[offset:offset + counts[project_id]]
+        offset += counts[project_id]
+    return shards
+
+
+def create_in_project(project_id: str, vm_names: List[str], zone_placement: ZonePlacement, image_project: str,
+                      image_family: str, startup_script: str = None, mode: str = "async",
+                      max_in_flight: int = 32, get_each: bool = False,
+                      vm_stats: Dict[str, Dict[str, Any]] = None, use_template: bool = False,
+                      boot_source: str = "image", source_name: str = None, timing: bool = False,
+                      wait_ready: bool = False, launch_id: str = None) -> Dict[str, Any]:
+    if mode == "bulk":
+        return bulk_create_fleet(project_id, zone_placement, vm_names, image_project, image_family, startup_script,
+                                 use_template, launch_id)
+    if mode == "threads":
+        if use_template:
+            print("Instance templates are only used in async and bulk mode.", file=sys.stderr, flush=True)
+        return create_vms_threaded(project_id, zone_placement, vm_names, image_project, image_family,
+                                   startup_script, max_in_flight, get_each, vm_stats, launch_id)
+    return asyncio.run(create_fleet(project_id, zone_placement, vm_names, image_project, image_family,
+                                    startup_script, max_in_flight, get_each=get_each, vm_stats=vm_stats,
+                                    use_template=use_template, boot_source=boot_source, source_name=source_name,
+                                    timing=timing, wait_ready=wait_ready, launch_id=launch_id))
+
+
+async def create_sharded_fleet(shards: Dict[str, List[str]], zone_placements: Dict[str, ZonePlacement],
+                               image_project: str, image_family: str, startup_script: str = None,
+                               max_in_flight: int = 32, get_each: bool = False,
+                               vm_stats: Dict[str, Dict[str, Any]] = None, use_template: bool = False,
+                               boot_source: str = "image", source_name: str = None,
+                               timing: bool = False, wait_ready: bool = False,
+                               launch_id: str = None) -> Dict[str, Any]:
+    # Every shard gets its own session, AIMD window and per-project rate limiter, all on one event loop.
+    outcomes = await asyncio.gather(*(
+        create_fleet(project_id, zone_placements[project_id], vm_names, image_project, image_family,
+                     startup_script, max_in_flight, get_each=get_each, vm_stats=vm_stats, use_template=use_template,
+                     boot_source=boot_source, source_name=source_name, timing=timing, wait_ready=wait_ready,
+                     launch_id=launch_id)
+        for project_id, vm_names in shards.items() if vm_names
+    ))
+    results = {}
+    for outcome in outcomes:
+        results.update(outcome)
+    return results
 
 
 def create_multiple_vms(start: int = 1, end: int = 2, name_prefix: str = "vm",
                         project_id: str = "plant-hero", zone: str = "us-central1-a",
                         image_project: str = "debian-cloud", image_family: str = "debian-10",
-                        startup_script: str = None) -> None:
-    threads = []
-    for i in range(start, end + 1):
-        vm_name = f"{name_prefix}{i}"
-        thread = create_vm(project_id, zone, vm_name, image_project, image_family, startup_script)
-        threads.append(thread)
-    for thread in threads:
-        thread.join()
+                        startup_script: str = None, mode: str = "async",
+                        max_in_flight: int = 32, zones: List[str] = None, placement: str = "spread",
+                        zone_weights: Dict[str, float] = None, projects: List[str] = None,
+                        sharding: str = "quota", get_each: bool = False,
+                        quota_policy: str = "refuse", vm_stats: Dict[str, Dict[str, Any]] = None,
+                        journal_path: str = None, resume: Dict[str, Dict[str, Any]] = None,
+                        restart_existing: bool = False, use_template: bool = False,
+                        use_baked: bool = True, boot_source: str = "image", source_name: str = None,
+                        timing: bool = False, wait_ready: bool = False, output: str = "text",
+                        launch_id: str = None) -> Dict[str, Any]:
+    launch_args = {key: value for key, value in locals().items()
+                   if key not in ("vm_stats", "journal_path", "resume", "launch_id")}
+    # A resumed launch keeps the journal's launch ID so its in-flight inserts replay the same request IDs.
+    launch_id = launch_id or new_launch_id()
+    journal_path = journal_path or os.path.join(
+        CACHE_DIR, "journals", f"{time.strftime('%Y%m%d-%H%M%S')}-{name_prefix}{start}-{end}.jsonl")
+    global _journal, _output
+    _journal = LaunchJournal(journal_path)
+    # With ndjson, stdout carries only the JSON documents; progress messages move to stderr.
+    _output = NdjsonOutput(sys.stdout) if output == "ndjson" else None
+    try:
+        with pinned_images(), redirect_stdout(sys.stderr) if _output else nullcontext():
+            if not resume:
+                _journal.record({"state": "launch", "launch_id": launch_id, "args": launch_args})
+            print(f"Journal: {journal_path} (continue an interrupted launch with --resume {journal_path})")
+            return _create_multiple_vms(start, end, name_prefix, project_id, zone, image_project, image_family,
+                                        startup_script, mode, max_in_flight, zones, placement, zone_weights,
+                                        projects, sharding, get_each, quota_policy, vm_stats, resume or {},
+                                        restart_existing, use_template, use_baked, boot_source, source_name, timing,
+                                        wait_ready, launch_id)
+    finally:
+        _journal.close()
+        _journal = None
+        _output = None
+
+
+def resume_launch(journal_path: str) -> Dict[str, Any]:
+    launch, states = LaunchJournal.replay(journal_path)
+    if not launch:
+        raise ValueError(f"{journal_path} has no launch record to resume from.")
+    counts = {}
+    for state in states.values():
+        counts[state["state"]] = counts.get(state["state"], 0) + 1
+    print(f"Resuming {journal_path}: " + ", ".join(f"{count} {state}" for state, count in sorted(counts.items())))
+    # The same launch ID regenerates the same insert request IDs, so GCE hands back the operations that were
+    # still in flight instead of creating a second VM.
+    return create_multiple_vms(**launch["args"], journal_path=journal_path, resume=states,
+                               launch_id=launch["launch_id"])
+
+
+def _create_multiple_vms(start: int, end: int, name_prefix: str, project_id: str, zone: str, image_project: str,
+                         image_family: str, startup_script: str, mode: str, max_in_flight: int, zones: List[str],
+                         placement: str, zone_weights: Dict[str, float], projects: List[str], sharding: str,
+                         get_each: bool, quota_policy: str, vm_stats: Dict[str, Dict[str, Any]],
+                         resume: Dict[str, Dict[str, Any]], restart_existing: bool,
+                         use_template: bool, use_baked: bool, boot_source: str, source_name: str,
+                         timing: bool, wait_ready: bool, launch_id: str) -> Dict[str, Any]:
+    if boot_source != "image" and not source_name:
+        raise ValueError(f"Booting from a {boot_source} needs the name of the {boot_source}.")
+    if (boot_source != "image" or timing or wait_ready) and mode != "async":
+        raise ValueError("Snapshot and machine image boot sources, timing and waiting for readiness need async mode.")
+    if use_template and boot_source != "image":
+        raise ValueError("Instance templates are built from the image family; use them with the image boot source.")
+    vm_stats = vm_stats if vm_stats is not None else {}
+    all_names = [f"{name_prefix}{i}" for i in range(start, end + 1)]
+    # VMs the journal already saw finish are only read back at the end.
+    done, in_flight, fresh, generations = resume_plan(all_names, resume)
+    vm_names = [vm_name for vm_name in all_names if vm_name not in done]
+    zones = zones or [zone]
+    projects = projects or [project_id]
+    # Existing VMs are only looked up here; they are started after the pre-flight checks below have passed.
+    existing = ({shard: list(fleet_snapshot(shard, vm_names).values()) for shard in projects}
+                if restart_existing and vm_names else {})
+    reused = {instance.name for instances in existing.values() for instance in instances}
+    vm_names = [vm_name for vm_name in vm_names if vm_name not in reused]
+    in_flight = {vm_name: state for vm_name, state in in_flight.items() if vm_name not in reused}
+    fresh = [vm_name for vm_name in fresh if vm_name not in reused]
+    for shard in projects:
+        try:
+            validate_launch(shard, zones, image_project, image_family)
+        except exceptions.GoogleAPICallError as e:
+            print(f"Could not refresh the catalog for {shard}, skipping validation: {e}", file=sys.stderr, flush=True)
+    if boot_source == "image" and use_baked and startup_script:
+        family = baked_family(image_project, image_family, startup_script)
+        if find_baked_image(projects[0], family):
+            # Everything the script installs is already on the image, so it does not need to run again.
+            print(f"Found baked image family {family} for this image and startup script; skipping the script.")
+            image_project, image_family, startup_script = projects[0], family, None
+    if boot_source == "image":
+        print(f"Using image {resolve_image(image_project, image_family)} for {image_project}/{image_family}.")
+    else:
+        print(f"Booting from {boot_source} {source_name}.")
+
+    # Pre-flight quota check: refuse, trim or split the launch before paying for inserts bound to fail.
+    capacities = {}
+    if quota_policy != "off":
+        for shard in projects:
+            try:
+                capacities[shard] = zone_capacity(shard, zones)
+            except exceptions.GoogleAPICallError as e:
+                print(f"Could not read quotas for {shard}, skipping the quota check: {e}", file=sys.stderr, flush=True)
+    # Interrupted inserts stay in their project and zone, where replaying the request ID finds their operation.
+    if len(projects) > 1 and sharding == "quota" and all(shard in capacities for shard in projects):
+        # Quota sharding caps every shard at its project's room, so the check per project below can never fire;
+        # refuse or report the trim against the room of all projects together instead.
+        room = sum(sum(capacity.values()) for capacity in capacities.values())
+        if len(fresh) > room and quota_policy == "refuse":
+            raise RuntimeError(f"Projects {', '.join(projects)} have quota for {room} more instances in "
+                               f"{', '.join(zones)}, but {len(fresh)} were requested. Use --quota-policy trim or "
+                               f"split, or add --zones / --projects.")
+        if len(fresh) > room:
+            print(f"Trimming the launch to {room} of {len(fresh)} instances to stay within quota.",
+                  file=sys.stderr, flush=True)
+    shards = shard_vm_names(fresh, projects, sharding, capacities) if len(projects) > 1 else {projects[0]: fresh}
+    zone_placements = {}
+    for shard in projects:
+        shards[shard], zone_placements[shard] = plan_launch(shard, shards[shard], zones, capacities.get(shard),
+                                                            quota_policy, placement, zone_weights)
+        resumed = {vm_name: state for vm_name, state in in_flight.items()
+                   if state.get("project", projects[0]) == shard}
+        shards[shard] += list(resumed)
+        zone_placements[shard].pinned = {vm_name: state["zone"] for vm_name, state in resumed.items()
+                                         if "zone" in state}
+        zone_placements[shard].generations = generations
+    restarted = restart_vms(existing, max_in_flight) if reused else {}
+
+    if len(projects) == 1:
+        results = create_in_project(projects[0], shards[projects[0]], zone_placements[projects[0]],
+                                    image_project, image_family, startup_script, mode, max_in_flight, get_each,
+                                    vm_stats, use_template, boot_source, source_name, timing, wait_ready, launch_id)
+    elif mode == "async":
+        results = asyncio.run(create_sharded_fleet(shards, zone_placements, image_project, image_family,
+                                                   startup_script, max_in_flight, get_each, vm_stats, use_template,
+                                                   boot_source, source_name, timing, wait_ready, launch_id))
+    else:
+        configure_client_pool(max_in_flight * len(projects))
+        results = {}
+        with ThreadPoolExecutor(max_workers=len(projects), thread_name_prefix="shard") as executor:
+            futures = [executor.submit(create_in_project, shard, shard_names, zone_placements[shard],
+                                       image_project, image_family, startup_script, mode, max_in_flight, get_each,
+                                       vm_stats, use_template, launch_id=launch_id)
+                       for shard, shard_names in shards.items() if shard_names]
+            for future in futures:
+                results.update(future.result())
+    for vm_name in vm_names:
+        if vm_name not in results:
+            results[vm_name] = RuntimeError(f"No quota left for {vm_name}.")
+        elif vm_name in resume and isinstance(results[vm_name], exceptions.Conflict):
+            # Past GCE's request ID window a replayed insert reports alreadyExists; the VM is ours.
+            done.append(vm_name)
+    by_project = {}
+    for vm_name in done:
+        by_project.setdefault(resume[vm_name].get("project", projects[0]), []).append(vm_name)
+    for shard, shard_names in by_project.items():
+        snapshot = fleet_snapshot(shard, shard_names)
+        for vm_name in shard_names:
+            results[vm_name] = snapshot.get(vm_name) or RuntimeError(f"{vm_name} was created but no longer exists.")
+            if vm_name in snapshot:
+                journal_event(vm_name, "done")
+    results.update(restarted)
+    results = {vm_name: results[vm_name] for vm_name in all_names}
+
+    created = sum(1 for result in results.values() if not isinstance(result, Exception))
+    print(f"{created} created, {len(results) - created} failed.")
+    if restarted:
+        print(f"{sum(1 for result in restarted.values() if not isinstance(result, Exception))} of these were "
+              f"existing instances restarted instead of created.")
+    placed = {}
+    for result in results.values():
+        if not isinstance(result, Exception):
+            # .../projects/{project}/zones/{zone}
+            parts = result.zone.split("/")
+            key = f"{parts[-3]}/{parts[-1]}" if len(projects) > 1 else parts[-1]
+            placed[key] = placed.get(key, 0) + 1
+    for key, count in sorted(placed.items()):
+        print(f" - {key}: {count}")
+    retried = {vm_name: stats for vm_name, stats in vm_stats.items() if stats["retries"]}
+    if retried:
+        print(f"Retried {len(retried)} instances, {sum(stats['retries'] for stats in retried.values())} retries, "
+              f"{sum(stats['backoff_seconds'] for stats in retried.values()):.1f}s backing off:")
+        for vm_name, stats in retried.items():
+            print(f" - {vm_name}: {stats['retries']} retries, {stats['backoff_seconds']:.1f}s")
+    if wait_ready:
+        ready = sorted((stats["ready_at"], vm_name) for vm_name, stats in vm_stats.items() if "ready_at" in stats)
+        print(f"{len(ready)} instances ready:")
+        for ready_at, vm_name in ready:
+            print(f" - {vm_name}: ready at {time.strftime('%H:%M:%S', time.localtime(ready_at))} "
+                  f"(+{vm_stats[vm_name]['ready_seconds']:.0f}s)")
+    report = timing_report(boot_source, vm_stats) if timing else None
+    if _output is not None:
+        # VMs that were not streamed (threads and bulk mode, restarts, resumed ones) are written out now.
+        for vm_name in all_names:
+            emit_vm(vm_name, results[vm_name], vm_stats.get(vm_name))
+        _output.write({"type": "summary", "requested": len(all_names), "created": created,
+                       "failed": len(results) - created, "restarted": len(restarted), "placement": placed,
+                       "failed_vms": [vm_name for vm_name, result in results.items() if isinstance(result, Exception)],
+                       "journal": _journal.path if _journal else None, "timings": report})
+    return results
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Create virtual machines.')
-    parser.add_argument('--start', type=int, default=1, help='start number of virtual machines')
-    parser.add_argument('--end', type=int, default=2, help='end number of virtual machines')
+    parser.add_argument('command', nargs='?', default='create',
+                        choices=['create', 'reconcile', 'delete', 'stop', 'start', 'suspend', 'resume', 'pool',
+                                 'acquire', 'bake', 'exec'],
+                        help='create the --start/--end range, reconcile the --prefix fleet to --count vms, '
+                             'delete, stop, start, suspend or resume the vms selected by --prefix, --start/--end '
+                             'and --label, fill the --pool warm pool, acquire --count vms from it, bake --script '
+                             'into an image family, or run --cmd over ssh on the selected vms')
+    parser.add_argument('--start', type=int, default=None, help='start number of virtual machines (default: 1)')
+    parser.add_argument('--end', type=int, default=None, help='end number of virtual machines (default: 2)')
     parser.add_argument('-s', '--script', type=str,
                         default='''#!/bin/bash
                         touch startup_script_success_run.txt
                         sudo apt-get update
                         sudo apt-get install -y docker.io
-                        sudo docker run -d -p 80:80 nginx
+                        sudo docker run -d --restart always -p 80:80 nginx
                         sudo apt install -y python3 python3-pip
                         sudo python3 -m pip install ray
+                        vm-phase packages-installed
                         ''',
                         help='startup script for virtual machines')
     parser.add_argument('-p', '--project', type=str, default='plant-hero', help='project ID')
+    parser.add_argument('--projects', type=str, default=None,
+                        help='comma separated project IDs to shard the range across')
+    parser.add_argument('--sharding', type=str, default='quota', choices=['quota', 'even'],
+                        help='split the range by free instance quota per project, or evenly')
     parser.add_argument('-z', '--zone', type=str, default='us-central1-a', help='zone')
+    parser.add_argument('--zones', type=str, default=None,
+                        help='comma separated zones to fail over between, optionally weighted as zone:weight')
+    parser.add_argument('--placement', type=str, default='spread', choices=['spread', 'fill-first', 'weighted'],
+                        help='how vms are placed across --zones')
     parser.add_argument('-i', '--image-project', type=str, default='debian-cloud', help='image project')
     parser.add_argument('-f', '--image-family', type=str, default='debian-11', help='image family')
-    parser.add_argument('-n', '--name-prefix', type=str, default='vm-', help='prefix for vm name')
+    parser.add_argument('-n', '--name-prefix', '--prefix', type=str, default=None,
+                        help='prefix for vm name (default: vm- for create and reconcile, none when selecting vms)')
+    parser.add_argument('--count', type=int, default=None,
+                        help='desired fleet size for reconcile, or number of vms to acquire')
+    parser.add_argument('--label', type=str, default=None,
+                        help='comma separated key=value labels the selected vms must all have')
+    parser.add_argument('-y', '--yes', action='store_true',
+                        help='delete (or delete the reconcile surplus) without asking for confirmation')
+    parser.add_argument('-m', '--mode', type=str, default='async', choices=['async', 'threads', 'bulk'],
+                        help='asyncio engine, worker threads, or one bulk insert for the whole range')
+    parser.add_argument('--max-in-flight', type=int, default=32, help='maximum number of vms worked on at once')
+    parser.add_argument('--read-rate', type=float, default=DEFAULT_RATE_LIMITS['read'],
+                        help='read API calls per minute per project')
+    parser.add_argument('--write-rate', type=float, default=DEFAULT_RATE_LIMITS['write'],
+                        help='write API calls per minute per project')
+    parser.add_argument('--quota-policy', type=str, default='refuse', choices=['refuse', 'trim', 'split', 'off'],
+                        help='what to do when the regional quotas cannot fit the requested range')
+    parser.add_argument('--journal', type=str, default=None,
+                        help='where to write the launch journal (default: ~/.cache/create_gcp_vms/journals/)')
+    parser.add_argument('--resume', type=str, default=None,
+                        help='continue the interrupted launch recorded in this journal')
+    parser.add_argument('--template', action='store_true',
+                        help='create or reuse an instance template for the config and insert vms from it')
+    parser.add_argument('--boot-source', type=str, default='image', choices=['image', 'snapshot', 'machine-image'],
+                        help='boot disks from the image family, a disk snapshot, or a machine image')
+    parser.add_argument('--source', type=str, default=None,
+                        help='snapshot or machine image name (or full path) for --boot-source')
+    parser.add_argument('--timing', action='store_true',
+                        help='wait for every vm to finish its startup scripts and report insert, running and '
+                             'script times')
+    parser.add_argument('--wait-ready', action='store_true',
+                        help='wait until the startup script on every vm reports service-up (or failed)')
+    parser.add_argument('-o', '--output', type=str, default='text', choices=['text', 'ndjson'],
+                        help='ndjson streams one json object per vm to stdout as it comes up, then a summary')
+    parser.add_argument('--no-baked', action='store_true',
+                        help='run the startup script even if a baked image family exists for it')
+    parser.add_argument('--restart-existing', action='store_true',
+                        help='start or resume stopped and suspended vms in the range instead of creating them')
+    parser.add_argument('--pool', type=str, default='warm-pool', help='name of the warm pool')
+    parser.add_argument('--pool-size', type=int, default=2, help='parked vms the warm pool keeps per zone')
+    parser.add_argument('--park', type=str, default='stop', choices=['stop', 'suspend'],
+                        help='how warm pool vms are parked once booted')
+    parser.add_argument('--boot-seconds', type=float, default=1800,
+                        help='how long a warm pool vm may take to get ready before it counts as failed')
+    parser.add_argument('-c', '--cmd', type=str, default=None, help='shell command for exec to run on every vm')
+    parser.add_argument('--ssh-user', type=str, default=None, help='ssh user for exec (default: local user)')
+    parser.add_argument('--ssh-key', type=str, default=None,
+                        help='ssh private key for exec (default: ~/.ssh/google_compute_engine if it exists)')
+    parser.add_argument('--ssh-timeout', type=float, default=300, help='seconds a command may run on one vm')
+    parser.add_argument('--internal-ip', action='store_true', help='connect to internal instead of external ips')
+    parser.add_argument('--get-each', action='store_true',
+                        help='get every vm after it is created instead of one list call for the whole fleet')
     args = parser.parse_args()
 
-    create_multiple_vms(args.start, args.end, args.name_prefix, args.project, args.zone, args.image_project,
-                        args.image_family, args.script)
+    configure_rate_limits(args.read_rate, args.write_rate)
+    zones, zone_weights = parse_zones(args.zones) if args.zones else (None, None)
+    projects = [project.strip() for project in args.projects.split(',') if project.strip()] if args.projects else None
+    if args.command in LIFECYCLE_ACTIONS or args.command == 'exec':
+        # No default prefix here, so --label alone can select vms named anything (warm pool vms, for one).
+        if not args.name_prefix and not args.label:
+            parser.error(f'{args.command} needs --prefix or --label to select vms')
+        if not args.name_prefix and (args.start is not None or args.end is not None):
+            parser.error('--start and --end number the vms after --prefix')
+    elif args.name_prefix is None:
+        args.name_prefix = 'vm-'
+
+    if args.command in ('pool', 'acquire'):
+        if args.command == 'acquire' and args.count is None:
+            parser.error('acquire needs --count')
+        pool = WarmPool(args.project, args.pool, zones or [args.zone], args.pool_size, args.image_project,
+                        args.image_family, args.script, args.park, args.boot_seconds, args.max_in_flight)
+        asyncio.run(pool.refill() if args.command == 'pool' else acquire_from_pool(pool, args.count))
+    elif args.command == 'bake':
+        bake_image(args.project, args.zone, args.image_project, args.image_family, args.script)
+    elif args.command == 'exec':
+        if not args.cmd:
+            parser.error('exec needs --cmd')
+        selection = list_vms(projects or [args.project], args.name_prefix, args.start, args.end,
+                             parse_labels(args.label) if args.label else None)
+        results = exec_vms(selection, args.cmd, args.ssh_user, args.ssh_key, args.max_in_flight, args.ssh_timeout,
+                           args.internal_ip, output=args.output)
+        sys.exit(0 if all(result["exit_code"] == 0 for result in results.values()) else 1)
+    elif args.command == 'reconcile':
+        if args.count is None:
+            parser.error('reconcile needs --count')
+        reconcile(args.project, args.name_prefix, args.count, zones or [args.zone], args.placement, zone_weights,
+                  args.image_project, args.image_family, args.script, args.max_in_flight, args.yes)
+    elif args.command in LIFECYCLE_ACTIONS:
+        selection = list_vms(projects or [args.project], args.name_prefix, args.start, args.end,
+                             parse_labels(args.label) if args.label else None)
+        count = sum(len(instances) for instances in selection.values())
+        print(f"Selected {count} instances: " + ", ".join(
+            instance.name for instances in selection.values() for instance in instances))
+        if args.command != 'delete':
+            change_vms(selection, args.command, args.max_in_flight)
+        elif count and (args.yes or input(f"Delete {count} instances? [y/N] ").strip().lower() == 'y'):
+            delete_vms(selection, args.max_in_flight)
+    elif args.resume:
+        resume_launch(args.resume)
+    else:
+        create_multiple_vms(1 if args.start is None else args.start, 2 if args.end is None else args.end,
+                            args.name_prefix, args.project, args.zone, args.image_project, args.image_family,
+                            args.script, args.mode, args.max_in_flight, zones, args.placement, zone_weights, projects,
+                            args.sharding, args.get_each, args.quota_policy, journal_path=args.journal,
+                            restart_existing=args.restart_existing, use_template=args.template,
+                            use_baked=not args.no_baked, boot_source=args.boot_source, source_name=args.source,
+                            timing=args.timing, wait_ready=args.wait_ready, output=args.output)
@@ -0,0 +1,67 @@
+import json
+
+import create_gcp_vms
+
+
+def write_journal(path, events, tail=""):
+    with open(path, "w") as f:
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+        f.write(tail)
+
+
+def test_replay_keeps_the_launch_header_and_the_last_state_per_vm(tmp_path):
+    path = tmp_path / "launch.jsonl"
+    write_journal(path, [
+        {"state": "launch", "launch_id": "abc", "args": {"start": 1, "end": 3}},
+        {"vm": "vm-1", "state": "inserting", "project": "p", "zone": "us-central1-a", "request_id": "r1",
+         "generation": 0},
+        {"vm": "vm-1", "state": "pending", "operation": "op-1"},
+        {"vm": "vm-1", "state": "done"},
+        {"vm": "vm-2", "state": "inserting", "project": "p", "zone": "us-central1-b", "request_id": "r2",
+         "generation": 0},
+    ], tail='{"vm": "vm-2", "state": "pen')  # cut short by the crash
+
+    launch, states = create_gcp_vms.LaunchJournal.replay(str(path))
+
+    assert launch["launch_id"] == "abc"
+    assert launch["args"] == {"start": 1, "end": 3}
+    assert states["vm-1"]["state"] == "done"
+    # Fields from earlier events survive the later ones.
+    assert states["vm-1"]["zone"] == "us-central1-a"
+    assert states["vm-1"]["operation"] == "op-1"
+    assert states["vm-2"]["state"] == "inserting"
+    assert states["vm-2"]["request_id"] == "r2"
+
+
+def test_resume_plan_splits_done_in_flight_and_failed_vms(tmp_path):
+    path = tmp_path / "launch.jsonl"
+    write_journal(path, [
+        {"state": "launch", "launch_id": "abc", "args": {}},
+        {"vm": "vm-1", "state": "inserting", "project": "p", "zone": "z", "request_id": "r1", "generation": 0},
+        {"vm": "vm-1", "state": "done"},
+        {"vm": "vm-2", "state": "inserting", "project": "p", "zone": "z", "request_id": "r2", "generation": 1},
+        {"vm": "vm-2", "state": "pending", "operation": "op-2"},
+        {"vm": "vm-3", "state": "inserting", "project": "p", "zone": "z", "request_id": "r3", "generation": 2},
+        {"vm": "vm-3", "state": "failed", "error": "Quota 'CPUS' exceeded."},
+        {"vm": "vm-4", "state": "failed", "error": "No quota left for vm-4."},
+    ])
+    _, states = create_gcp_vms.LaunchJournal.replay(str(path))
+
+    done, in_flight, fresh, generations = create_gcp_vms.resume_plan(
+        ["vm-1", "vm-2", "vm-3", "vm-4", "vm-5"], states)
+
+    assert done == ["vm-1"]
+    assert list(in_flight) == ["vm-2"]
+    assert in_flight["vm-2"]["zone"] == "z"
+    assert fresh == ["vm-3", "vm-4", "vm-5"]
+    # The in-flight insert replays its own request ID; the failed one moves past it.
+    assert generations == {"vm-2": 1, "vm-3": 3}
+
+
+def test_failed_vms_get_a_new_request_id_on_resume():
+    _, _, _, generations = create_gcp_vms.resume_plan(
+        ["vm-1"], {"vm-1": {"state": "failed", "request_id": "r1", "generation": 0}})
+
+    first = create_gcp_vms.insert_request_id("abc", "p", "z", "vm-1", 0)
+    assert create_gcp_vms.insert_request_id("abc", "p", "z", "vm-1", generations["vm-1"]) != first